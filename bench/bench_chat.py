@@ -0,0 +1,291 @@
+# encoding:utf-8
+"""
+聊天消息压测：离线生成接近真实群聊的消息流，逐条调用 on_handle_context，统计每类消息的处理耗时和内存分配
+
+消息构成（按事件比例，可用 --mix 调整）：
+  text     群聊中与插件无关的文字消息，包括以 / 或 $ 开头但不是指令的内容
+  image    群聊中与插件无关的图片消息
+  private  私聊中与插件无关的文字消息
+  command  普通用户的 $ 指令（帮助、越权的管理员指令）
+  admin    已认证管理员的 $ 查询指令
+  imagine  同一个群内连续多人发送 /imagine（突发）
+  img2img  /img2img 之后紧跟一张图片
+
+消息对象提前生成，计时只包含 on_handle_context 本身；第二轮在 tracemalloc 下运行，统计每条消息的临时内存峰值、
+净增内存和净增内存块数。指令会提交给独立进程中的模拟代理（不会完成），提交过程在工作线程中进行，不计入消息耗时。
+
+--save-baseline 保存本次结果，--baseline 与已保存的结果对比，超过容差的指标标记为回归并以非零状态码退出。
+
+用法: python bench/bench_chat.py [--messages 20000] [--groups 50] [--members 200] [--baseline base.json]
+      [--save-baseline base.json] [--tolerance 0.3] [--budget text=20 ...]
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, PLUGIN_DIR)
+
+import cow_env  # noqa: E402
+import fake_proxy  # noqa: E402
+from tracing import percentile  # noqa: E402
+
+CATEGORIES = ("text", "image", "private", "command", "admin", "imagine", "img2img", "image_followup")
+DEFAULT_MIX = "text=85,image=6,private=3,command=2,admin=0.5,imagine=2,img2img=1"
+
+CHAT_LINES = (
+    "哈哈哈哈", "收到", "今晚吃什么", "有人一起开黑吗", "这个周末去爬山", "[捂脸]", "1", "好的好的",
+    "刚看到群公告，明天几点集合？", "这张图是用什么画的，好好看", "老板说下午开会", "转发一下这个链接",
+    "/狗头", "/捂脸 笑死", "$100 红包已经抢完了", "$$$", "/imaginary friend", "/describe me", "/up", "$mj",
+    "Has anyone tried the new model yet?", "lol", "ok", "see you tomorrow", "@所有人 请大家查收邮件",
+)
+USER_COMMANDS = ("$mj_help", "$mjhelp", "$mj帮助", "$mj_g_info", "$mj_g_wgroup", "$mj_s_limit 5")
+ADMIN_COMMANDS = ("$mj_g_wgroup", "$mj_g_admin_list", "$mj_g_wuser", "$mj_admin_cmd", "$mj_g_info")
+PROMPTS = ("a cat astronaut, watercolor", "cyberpunk street at night --ar 16:9", "一只在月亮上钓鱼的熊猫",
+           "isometric cozy library, soft light", "portrait of an old sailor, oil painting --v 6")
+ADMIN_ID = "bench_admin"
+
+
+class Traffic:
+    """按比例生成消息，每条消息为 (类别, EventContext)"""
+
+    def __init__(self, sandbox, args, mix, seed, image_dir):
+        self.sandbox = sandbox
+        self.args = args
+        self.kinds, self.weights = zip(*mix.items())
+        self.rng = random.Random(seed)
+        self.image_dir = image_dir
+        self.images = 0
+        output = io.BytesIO()
+        Image.new("RGB", (256, 256), (120, 160, 200)).save(output, format="PNG")
+        self.png = output.getvalue()
+
+    def member(self, group):
+        return "g%03d_u%04d" % (group, self.rng.randrange(self.args.members))
+
+    def group(self):
+        # 少数活跃群贡献大部分消息
+        return min(int(self.rng.paretovariate(1.2)) - 1, self.args.groups - 1)
+
+    def message(self, content, user_id, group=None, type=cow_env.ContextType.TEXT):
+        group_id = "group%03d" % group if group is not None else None
+        return self.sandbox.message(content, user_id, type, group_id)
+
+    def image_file(self):
+        # 跟在 /img2img 后的图片会被提交线程读取并删除，每条消息使用单独的文件
+        self.images += 1
+        path = os.path.join(self.image_dir, "img%06d.png" % self.images)
+        with open(path, "wb") as f:
+            f.write(self.png)
+        return path
+
+    def event(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        group = self.group()
+        if kind == "text":
+            return [("text", self.message(self.rng.choice(CHAT_LINES), self.member(group), group))]
+        if kind == "image":
+            return [("image", self.message(os.path.join(self.image_dir, "unused.png"), self.member(group), group,
+                                           cow_env.ContextType.IMAGE))]
+        if kind == "private":
+            return [("private", self.message(self.rng.choice(CHAT_LINES), "p%05d" % self.rng.randrange(10000)))]
+        if kind == "command":
+            return [("command", self.message(self.rng.choice(USER_COMMANDS), self.member(group), group))]
+        if kind == "admin":
+            return [("admin", self.message(self.rng.choice(ADMIN_COMMANDS), ADMIN_ID))]
+        if kind == "imagine":
+            size = self.rng.randint(self.args.burst_min, self.args.burst_max)
+            return [("imagine", self.message("/imagine " + self.rng.choice(PROMPTS), self.member(group), group))
+                    for _ in range(size)]
+        user_id = self.member(group)
+        return [("img2img", self.message("/img2img " + self.rng.choice(PROMPTS), user_id, group)),
+                ("image_followup", self.message(self.image_file(), user_id, group, cow_env.ContextType.IMAGE))]
+
+    def generate(self, count):
+        messages = []
+        while len(messages) < count:
+            messages.extend(self.event())
+        return messages[:count]
+
+
+def run_timing(plugin, messages):
+    """返回 {类别: [耗时(纳秒)...]}"""
+    samples = defaultdict(list)
+    handle = plugin.on_handle_context
+    clock = time.perf_counter_ns
+    for category, e_context in messages:
+        start = clock()
+        handle(e_context)
+        samples[category].append(clock() - start)
+    return samples
+
+
+def run_allocations(plugin, messages):
+    """返回 {类别: [(临时峰值字节, 净增字节, 净增内存块)...]}，工作线程的分配也会计入，取中位数观察"""
+    samples = defaultdict(list)
+    handle = plugin.on_handle_context
+    tracemalloc.start()
+    try:
+        for category, e_context in messages:
+            tracemalloc.reset_peak()
+            blocks = sys.getallocatedblocks()
+            before = tracemalloc.get_traced_memory()[0]
+            handle(e_context)
+            current, peak = tracemalloc.get_traced_memory()
+            samples[category].append((peak - before, current - before, sys.getallocatedblocks() - blocks))
+    finally:
+        tracemalloc.stop()
+    return samples
+
+
+def summarize(timing, allocations):
+    report = {}
+    for category in CATEGORIES:
+        values = timing.get(category)
+        if not values:
+            continue
+        us = [v / 1000 for v in values]
+        allocs = allocations.get(category) or [(0, 0, 0)]
+        report[category] = {
+            "count": len(us),
+            "mean_us": sum(us) / len(us),
+            "p50_us": percentile(us, 50),
+            "p99_us": percentile(us, 99),
+            "max_us": max(us),
+            "peak_kb": percentile([a[0] for a in allocs], 50) / 1024,
+            "retained_bytes": sum(a[1] for a in allocs) / len(allocs),
+            "blocks": sum(a[2] for a in allocs) / len(allocs),
+        }
+    return report
+
+
+def check_regressions(report, baseline, tolerance, min_us, min_kb, budgets):
+    """返回回归描述列表，只比较受偶发停顿影响小的中位数，且同时超过比例容差和绝对阈值才算回归"""
+    regressions = []
+    for category, current in report["categories"].items():
+        base = (baseline or {}).get("categories", {}).get(category)
+        if base:
+            for metric, floor in (("p50_us", min_us), ("peak_kb", min_kb)):
+                old, new = base.get(metric), current[metric]
+                if old is not None and new > old * (1 + tolerance) and new - old > floor:
+                    regressions.append("%s %s %.2f -> %.2f (+%.0f%%)" % (
+                        category, metric, old, new, 100 * (new - old) / old if old else float("inf")))
+        budget = budgets.get(category)
+        if budget is not None and current["p50_us"] > budget:
+            regressions.append("%s p50_us %.2f over budget %.2f" % (category, current["p50_us"], budget))
+    return regressions
+
+
+def print_report(report):
+    print("%d messages, handler time %.1f ms total, %.0f msgs/s on the message thread" % (
+        report["messages"], report["handler_ms"], report["messages_per_second"]))
+    print("%-15s %7s %9s %9s %9s %10s %9s %10s %8s" % (
+        "category", "count", "mean(us)", "p50(us)", "p99(us)", "max(us)", "peak(KB)", "retain(B)", "blocks"))
+    for category, stat in report["categories"].items():
+        print("%-15s %7d %9.1f %9.1f %9.1f %10.1f %9.1f %10.0f %8.1f" % (
+            category, stat["count"], stat["mean_us"], stat["p50_us"], stat["p99_us"], stat["max_us"],
+            stat["peak_kb"], stat["retained_bytes"], stat["blocks"]))
+
+
+def parse_pairs(text, allowed=CATEGORIES):
+    pairs = {}
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        if name not in allowed:
+            raise argparse.ArgumentTypeError(f"unknown category {name}")
+        pairs[name] = float(value or 1)
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="on_handle_context 聊天消息压测")
+    parser.add_argument("--messages", type=int, default=20000, help="计时的消息数")
+    parser.add_argument("--warmup", type=int, default=2000, help="预热消息数，不计入结果")
+    parser.add_argument("--alloc-messages", type=int, default=5000, help="统计内存分配的消息数，0 表示跳过")
+    parser.add_argument("--groups", type=int, default=50, help="群数量")
+    parser.add_argument("--members", type=int, default=200, help="每个群的成员数")
+    parser.add_argument("--burst-min", type=int, default=3, help="/imagine 突发的最少条数")
+    parser.add_argument("--burst-max", type=int, default=10, help="/imagine 突发的最多条数")
+    parser.add_argument("--mix", type=parse_pairs, default=DEFAULT_MIX, help="事件比例")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--set", type=lambda s: (s.partition("=")[0], json.loads(s.partition("=")[2])),
+                        action="append", metavar="KEY=JSON", help="覆盖插件配置")
+    parser.add_argument("--baseline", help="与保存的结果对比")
+    parser.add_argument("--save-baseline", help="保存本次结果")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="允许的相对增幅")
+    parser.add_argument("--min-us", type=float, default=2.0, help="耗时增加少于该值（微秒）不算回归")
+    parser.add_argument("--min-kb", type=float, default=1.0, help="内存峰值增加少于该值（KB）不算回归")
+    parser.add_argument("--budget", type=lambda s: parse_pairs(s), action="append", default=[],
+                        metavar="CATEGORY=US", help="各类消息 p50 耗时上限（微秒）")
+    parser.add_argument("--log-level", default="ERROR", help="插件日志级别")
+    args = parser.parse_args()
+    budgets = {k: v for budget in args.budget for k, v in budget.items()}
+
+    # 指令会提交到模拟代理，任务永远不会完成，压测期间没有下载和发送结果的后台开销
+    proxy, proxy_url = fake_proxy.spawn("--latency", 0, "--complete", 86400, "--fast-complete", 86400)
+    image_dir = tempfile.mkdtemp(prefix="mj-chat-")
+    config = {"proxy_server": proxy_url, "proxy_api_secret": "bench", "submit_queue_size": 100000}
+    config.update(dict(args.set or []))
+    try:
+        with cow_env.PluginSandbox(config) as sandbox:
+            cow_env.set_log_level(args.log_level)
+            plugin = sandbox.plugin
+            plugin.on_handle_context(sandbox.message("$mj_admin_password " + plugin.mj_admin_password, ADMIN_ID))
+            traffic = Traffic(sandbox, args, args.mix, args.seed, image_dir)
+            run_timing(plugin, traffic.generate(args.warmup))
+            messages = traffic.generate(args.messages)
+            gc.collect()
+            wall_start = time.perf_counter()
+            timing = run_timing(plugin, messages)
+            wall = time.perf_counter() - wall_start
+            allocations = {}
+            if args.alloc_messages:
+                allocations = run_allocations(plugin, traffic.generate(args.alloc_messages))
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+    handler_ns = sum(sum(values) for values in timing.values())
+    report = {
+        "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "log_level")},
+        "messages": args.messages,
+        "wall_seconds": wall,
+        "handler_ms": handler_ns / 1e6,
+        "messages_per_second": args.messages / (handler_ns / 1e9) if handler_ns else 0.0,
+        "categories": summarize(timing, allocations),
+    }
+    print_report(report)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = check_regressions(report, baseline, args.tolerance, args.min_us, args.min_kb, budgets)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if regressions:
+        print("REGRESSION:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    if baseline or budgets:
+        print("no regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# encoding:utf-8
+"""
+端到端吞吐基准：启动本地模拟代理（独立进程），在临时目录中加载插件，由 N 个模拟用户循环发送指令，
+统计每秒提交数、提交到结果送达的延迟分位数，以及插件进程的 CPU 和内存占用
+
+每个用户发送一条指令后等待最终结果（完成、失败或被拒绝）再发下一条，指令按 --mix 的比例随机选择，
+/up 作用于该用户最近完成的绘图任务，/describe 先发指令再发一张随机生成的图片
+
+用法: python bench/bench_e2e.py [--users 20] [--rounds 5] [--complete 10] [--latency 0.05] [--error-rate 0]
+      [--fail-rate 0] [--mix imagine=6,up=2,describe=1,shorten=1] [--notify] [--set key=json ...] [--json 输出文件]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from PIL import Image, ImageDraw
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, PLUGIN_DIR)
+
+import cow_env  # noqa: E402
+import fake_proxy  # noqa: E402
+from tracing import percentile  # noqa: E402
+
+TASK_ID_RE = re.compile(r"任务ID: (\S+)")
+# 这些即时回复表示指令已受理，结果稍后通过渠道发送
+PENDING_REPLIES = ("已进入队列", "请给我发一张图片")
+
+
+def classify(text):
+    """根据回复文本判断是否为最终结果，返回 success / failure / rejected，中间消息返回 None"""
+    if "任务已完成" in text:
+        return "success"
+    if "任务执行失败" in text:
+        return "failure"
+    if "任务提交失败" in text or "暂时不可用" in text or "无需重复发送" in text or "使用次数已用完" in text:
+        return "rejected"
+    return None
+
+
+class Inbox:
+    """单个模拟用户收到的消息，等待当前指令的最终结果"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.result = None
+        self.messages = 0
+
+    def reset(self):
+        with self.cond:
+            self.result = None
+
+    def put(self, status, text):
+        with self.cond:
+            self.messages += 1
+            if status and self.result is None:
+                self.result = (status, text, time.perf_counter())
+                self.cond.notify_all()
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.result is not None, timeout)
+            return self.result
+
+
+class Recorder:
+    def __init__(self):
+        self.inboxes = defaultdict(Inbox)
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # 指令 -> 成功的延迟列表
+        self.outcomes = defaultdict(lambda: defaultdict(int))  # 指令 -> 结果 -> 次数
+        self.sent = 0
+
+    def inbox(self, user_id):
+        with self.lock:
+            return self.inboxes[user_id]
+
+    def on_send(self, reply, context):
+        content = reply.content if isinstance(reply.content, str) else ""
+        self.inbox(context.get("receiver")).put(classify(content), content)
+
+    def record(self, command, status, latency):
+        with self.lock:
+            self.outcomes[command][status] += 1
+            if status == "success":
+                self.samples[command].append(latency)
+
+
+def random_image(rng, side=256):
+    """随机生成一张小图，避免 /describe 命中结果缓存"""
+    image = Image.new("RGB", (side, side), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        box = sorted(rng.randrange(side) for _ in range(2)) + sorted(rng.randrange(side) for _ in range(2))
+        draw.rectangle((box[0], box[2], box[1], box[3]), fill=tuple(rng.randrange(256) for _ in range(3)))
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+class SimulatedUser:
+    def __init__(self, index, sandbox, recorder, args, mix):
+        self.user_id = "bench%04d" % index
+        self.sandbox = sandbox
+        self.plugin = sandbox.plugin
+        self.recorder = recorder
+        self.inbox = recorder.inbox(self.user_id)
+        self.args = args
+        self.mix = mix
+        self.rng = random.Random((args.seed or 0) * 100003 + index)
+        self.last_task = None
+
+    def prompt(self, round_index):
+        if self.args.prompt_pool:
+            return "a watercolor lighthouse, style %d" % self.rng.randrange(self.args.prompt_pool)
+        return "a watercolor lighthouse %s round %d" % (self.user_id, round_index)
+
+    def send(self, content, type=cow_env.ContextType.TEXT):
+        e_context = self.sandbox.message(content, self.user_id, type)
+        self.plugin.on_handle_context(e_context)
+        with self.recorder.lock:
+            self.recorder.sent += 1
+        reply = e_context.get("reply")
+        if reply is None or not isinstance(reply.content, str):
+            return None
+        if any(text in reply.content for text in PENDING_REPLIES):
+            return None
+        # 即时回复的最终结果（被拒绝、缓存命中等）
+        return classify(reply.content) or "rejected", reply.content
+
+    def run_command(self, command, round_index):
+        self.inbox.reset()
+        if command == "up" and self.last_task is None:
+            command = "imagine"
+        if command == "describe":
+            immediate = self.send("/describe")
+            if immediate is None:
+                fd, path = tempfile.mkstemp(suffix=".png")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(random_image(self.rng))
+                start = time.perf_counter()
+                immediate = self.send(path, cow_env.ContextType.IMAGE)
+            else:
+                start = time.perf_counter()
+        else:
+            start = time.perf_counter()
+            if command == "imagine":
+                immediate = self.send("/imagine " + self.prompt(round_index))
+            elif command == "up":
+                immediate = self.send("/up %s %d" % (self.last_task, self.rng.randint(1, 4)))
+            else:
+                immediate = self.send("/shorten " + self.prompt(round_index))
+        if immediate is not None:
+            status, text, end = immediate[0], immediate[1], time.perf_counter()
+        else:
+            result = self.inbox.wait(self.args.timeout)
+            if result is None:
+                status, text, end = "timeout", "", time.perf_counter()
+            else:
+                status, text, end = result
+        self.recorder.record(command, status, end - start)
+        if command == "imagine" and status == "success":
+            match = TASK_ID_RE.search(text)
+            self.last_task = match.group(1) if match else None
+
+    def run(self):
+        time.sleep(self.rng.uniform(0, self.args.ramp))
+        commands, weights = zip(*self.mix.items())
+        for round_index in range(self.args.rounds):
+            self.run_command(self.rng.choices(commands, weights)[0], round_index)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("imagine", "up", "describe", "shorten"):
+            raise argparse.ArgumentTypeError(f"unknown command {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_set(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_proxy(args):
+    options = ["--latency", args.latency, "--jitter", args.jitter, "--complete", args.complete,
+               "--fast-complete", args.fast_complete, "--error-rate", args.error_rate, "--fail-rate", args.fail_rate,
+               "--image-side", args.image_side]
+    if args.seed is not None:
+        options += ["--seed", args.seed]
+    return fake_proxy.spawn(*options)
+
+
+def plugin_config(args, proxy_url):
+    config = {
+        "proxy_server": proxy_url,
+        "proxy_api_secret": "bench",
+        "daily_limit": 1000000,
+        "rate_limit_enabled": False,
+        "submit_queue_size": max(50, args.users * 2),
+    }
+    if args.notify:
+        port = free_port()
+        config.update({"notify_hook_enabled": True, "notify_hook_host": "127.0.0.1", "notify_hook_port": port,
+                       "notify_hook_url": f"http://127.0.0.1:{port}/mj/notify"})
+    config.update(dict(args.set or []))
+    return config
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return None
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    proxy, proxy_url = start_proxy(args)
+    recorder = Recorder()
+    cow_env.WechatChannel.on_send = recorder.on_send
+    try:
+        with cow_env.PluginSandbox(plugin_config(args, proxy_url)) as sandbox:
+            cow_env.set_log_level(args.log_level)
+            users = [SimulatedUser(i, sandbox, recorder, args, mix) for i in range(args.users)]
+            threads = [threading.Thread(target=user.run, name=user.user_id, daemon=True) for user in users]
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            rss = rss_mb()
+            threads_alive = threading.active_count()
+    finally:
+        cow_env.WechatChannel.on_send = None
+        proxy.terminate()
+        proxy.wait()
+
+    commands = {}
+    total = defaultdict(int)
+    for command in sorted(recorder.outcomes):
+        samples = recorder.samples[command]
+        outcomes = dict(recorder.outcomes[command])
+        for status, count in outcomes.items():
+            total[status] += count
+        commands[command] = {
+            "count": sum(outcomes.values()),
+            "outcomes": outcomes,
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+            "max": max(samples) if samples else 0.0,
+        }
+    all_samples = [v for samples in recorder.samples.values() for v in samples]
+    submitted = sum(total.values())
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "log_level")},
+        "wall_seconds": wall,
+        "submitted": submitted,
+        "messages": recorder.sent,
+        "outcomes": dict(total),
+        "submissions_per_second": submitted / wall if wall else 0.0,
+        "completions_per_second": total["success"] / wall if wall else 0.0,
+        "latency": {
+            "p50": percentile(all_samples, 50),
+            "p95": percentile(all_samples, 95),
+            "p99": percentile(all_samples, 99),
+            "max": max(all_samples) if all_samples else 0.0,
+        },
+        "commands": commands,
+        "cpu_seconds": cpu,
+        "cpu_percent": 100 * cpu / wall if wall else 0.0,
+        "rss_mb": rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "threads": threads_alive,
+    }
+
+
+def print_report(report):
+    print("users=%(users)s rounds=%(rounds)s complete=%(complete)ss latency=%(latency)ss "
+          "error_rate=%(error_rate)s fail_rate=%(fail_rate)s notify=%(notify)s" % report["params"])
+    print("wall %.1fs, %d submissions (%s), %d messages" % (
+        report["wall_seconds"], report["submitted"],
+        ", ".join(f"{k}={v}" for k, v in sorted(report["outcomes"].items())), report["messages"]))
+    print("throughput: %.2f submissions/s, %.2f completions/s" % (
+        report["submissions_per_second"], report["completions_per_second"]))
+    print("%-10s %6s %9s %9s %9s %9s" % ("command", "count", "p50(s)", "p95(s)", "p99(s)", "max(s)"))
+    rows = list(report["commands"].items()) + [("all", {**report["latency"], "count": report["submitted"]})]
+    for command, stat in rows:
+        print("%-10s %6d %9.2f %9.2f %9.2f %9.2f" % (command, stat["count"], stat["p50"], stat["p95"],
+                                                     stat["p99"], stat["max"]))
+    rss = "%.1f MB" % report["rss_mb"] if report["rss_mb"] is not None else "n/a"
+    print("cpu %.2fs (%.1f%%), rss %s, peak rss %.1f MB, threads %d" % (
+        report["cpu_seconds"], report["cpu_percent"], rss, report["peak_rss_mb"], report["threads"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Midjourney 插件端到端吞吐基准")
+    parser.add_argument("--users", type=int, default=20, help="模拟用户数")
+    parser.add_argument("--rounds", type=int, default=5, help="每个用户发送的指令数")
+    parser.add_argument("--ramp", type=float, default=2.0, help="用户在该时间内随机错开开始（秒）")
+    parser.add_argument("--mix", default="imagine=6,up=2,describe=1,shorten=1", help="指令比例")
+    parser.add_argument("--prompt-pool", type=int, default=0, help="提示词从 K 个中随机选择，0 表示每次都不同")
+    parser.add_argument("--timeout", type=float, default=None, help="等待单条指令结果的超时（秒）")
+    parser.add_argument("--notify", action="store_true", help="开启 notifyHook 回调代替轮询")
+    parser.add_argument("--set", type=parse_set, action="append", metavar="KEY=JSON", help="覆盖插件配置")
+    parser.add_argument("--json", help="将结果写入 JSON 文件，便于前后对比")
+    parser.add_argument("--log-level", default="WARNING", help="插件日志级别")
+    fake_proxy.add_arguments(parser)
+    args = parser.parse_args()
+    if args.timeout is None:
+        args.timeout = args.complete * 3 + 60
+    if args.seed is None:
+        args.seed = 1
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
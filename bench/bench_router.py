@@ -0,0 +1,102 @@
+# encoding:utf-8
+"""
+指令分发微基准：对比旧版 startswith/any 链与 CommandRouter 的单条消息分发耗时
+
+用法: python bench/bench_router.py [消息数]
+"""
+import ast
+import os
+import random
+import sys
+import timeit
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+from router import CommandRouter  # noqa: E402
+
+
+def load_command_tables():
+    # ctext.py 依赖宿主程序的模块，这里直接从源码中读取指令表
+    with open(os.path.join(PLUGIN_DIR, "ctext.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    tables = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and node.targets[0].id in ("COMMANDS", "ADMIN_COMMANDS"):
+            tables[node.targets[0].id] = ast.literal_eval(node.value)
+    return tables["COMMANDS"], tables["ADMIN_COMMANDS"]
+
+
+COMMANDS, ADMIN_COMMANDS = load_command_tables()
+
+
+def legacy_dispatch(content, trigger_prefix="$"):
+    # 与旧版 on_handle_context / handle_command 相同的匹配顺序
+    if content.startswith(trigger_prefix):
+        cmd = content[1:].strip().split()[0]
+        if any(cmd in info["alias"] for info in COMMANDS.values()):
+            return next(c for c, info in COMMANDS.items() if cmd in info["alias"])
+        elif any(cmd in info["alias"] for info in ADMIN_COMMANDS.values()):
+            return next(c for c, info in ADMIN_COMMANDS.items() if cmd in info["alias"])
+        return None
+    if content.startswith("/imagine "):
+        return "/imagine"
+    elif content.startswith("/up "):
+        return "/up"
+    elif content.startswith("/img2img "):
+        return "/img2img"
+    elif content == "/describe":
+        return "/describe"
+    elif content.startswith("/shorten "):
+        return "/shorten"
+    elif content.startswith("/seed "):
+        return "/seed"
+    return None
+
+
+def build_router():
+    router = CommandRouter("$")
+    for name, info in COMMANDS.items():
+        router.add_command(info["alias"], name, None)
+    for name, info in ADMIN_COMMANDS.items():
+        router.add_command(info["alias"], name, None, admin=True)
+    for cmd in ("/imagine", "/up", "/img2img", "/shorten", "/seed"):
+        router.add_slash(cmd, None)
+    router.add_slash("/describe", None, with_args=False)
+    return router
+
+
+def build_messages(n, seed=42):
+    # 群聊中绝大多数消息与插件无关
+    rnd = random.Random(seed)
+    chatter = ["哈哈哈", "今天吃什么", "收到", "@小明 在吗", "https://example.com/a", "好的👌", "晚上开会", "[图片]"]
+    plugin = ["/imagine a cat in space --ar 16:9", "/up 1712345678 1", "$mj_help", "$查询白名单用户", "$mj_g_info"]
+    other_plugins = ["$help", "$tool google 天气", "/start"]
+    messages = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.90:
+            messages.append(rnd.choice(chatter))
+        elif r < 0.95:
+            messages.append(rnd.choice(other_plugins))
+        else:
+            messages.append(rnd.choice(plugin))
+    return messages
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    messages = build_messages(n)
+    router = build_router()
+    # 两种分发方式对同一批消息必须得到相同结果
+    for m in messages[:2000]:
+        route = router.match(m)
+        assert (route.name if route else None) == legacy_dispatch(m), m
+
+    for name, fn in (("legacy", legacy_dispatch), ("router", router.match)):
+        best = min(timeit.repeat(lambda: [fn(m) for m in messages], number=1, repeat=5))
+        print("%-8s %8.1f ns/msg" % (name, best / n * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# encoding:utf-8
+"""
+基准测试用的宿主程序替身：注册插件依赖的 bridge / channel / common / config / lib.itchat / plugins 模块，
+并把插件源码复制到临时目录中加载，配置文件、数据库和图片缓存都写在临时目录里，不影响插件目录
+
+仅供 bench 下的脚本使用，正式运行时这些模块由 chatgpt-on-wechat 提供
+"""
+import atexit
+import glob
+import importlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+from enum import Enum
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ContextType(Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+
+
+class Context:
+    def __init__(self, type=None, content=None, kwargs=None):
+        self.type = type
+        self.content = content
+        self.kwargs = kwargs or {}
+
+    def __contains__(self, key):
+        return key in self.kwargs
+
+    def __getitem__(self, key):
+        return self.kwargs[key]
+
+    def __setitem__(self, key, value):
+        self.kwargs[key] = value
+
+    def get(self, key, default=None):
+        return self.kwargs.get(key, default)
+
+
+class ReplyType(Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+    IMAGE_URL = 4
+    VIDEO_URL = 5
+    FILE = 6
+    CARD = 7
+    InviteRoom = 8
+    INFO = 9
+    ERROR = 10
+
+
+class Reply:
+    def __init__(self, type=None, content=None):
+        self.type = type
+        self.content = content
+
+
+class ChatMessage:
+    def __init__(self, user_id, nickname=None, group_id=None, group_name=None):
+        nickname = nickname or user_id
+        self.from_user_id = group_id or user_id
+        self.from_user_nickname = group_name or nickname
+        self.other_user_id = self.from_user_id
+        self.other_user_nickname = self.from_user_nickname
+        self.actual_user_id = user_id
+        self.actual_user_nickname = nickname
+        self.is_group = group_id is not None
+
+    def prepare(self):
+        pass
+
+
+class WechatChannel:
+    """所有发送都转给 on_send 回调，由基准脚本统计"""
+    on_send = None
+
+    def send(self, reply, context):
+        if WechatChannel.on_send:
+            WechatChannel.on_send(reply, context)
+
+
+class ExpiredDict(dict):
+    def __init__(self, expires_in_seconds):
+        super().__init__()
+        self.expires_in_seconds = expires_in_seconds
+
+    def __getitem__(self, key):
+        value, expiry_time = super().__getitem__(key)
+        if datetime.now() > expiry_time:
+            del self[key]
+            raise KeyError("expired {}".format(key))
+        self.__setitem__(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
+        super().__setitem__(key, (value, expiry_time))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def keys(self):
+        return [key for key in list(super().keys()) if key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return self.keys().__iter__()
+
+
+class Event(Enum):
+    ON_RECEIVE_MESSAGE = 1
+    ON_HANDLE_CONTEXT = 2
+    ON_DECORATE_REPLY = 3
+    ON_SEND_REPLY = 4
+
+
+class EventAction(Enum):
+    CONTINUE = 1
+    BREAK = 2
+    BREAK_PASS = 3
+
+
+class EventContext:
+    def __init__(self, event, econtext=None):
+        self.event = event
+        self.econtext = econtext or {}
+        self.action = EventAction.CONTINUE
+
+    def __getitem__(self, key):
+        return self.econtext[key]
+
+    def __setitem__(self, key, value):
+        self.econtext[key] = value
+
+    def __delitem__(self, key):
+        del self.econtext[key]
+
+    def get(self, key, default=None):
+        return self.econtext.get(key, default)
+
+
+class Plugin:
+    def __init__(self):
+        self.handlers = {}
+
+
+def register(**kwargs):
+    def wrapper(cls):
+        return cls
+    return wrapper
+
+
+CONF = {"channel_type": "bench", "plugin_trigger_prefix": "$"}
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """注册宿主程序模块，重复调用无副作用"""
+    if "plugins" in sys.modules:
+        return
+    logger = logging.getLogger("bench.cow")
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("[%(levelname)s][%(asctime)s] %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+
+    for package in ("bridge", "channel", "channel.wechat", "common", "lib"):
+        _module(package, __path__=[])
+    _module("bridge.context", ContextType=ContextType, Context=Context)
+    _module("bridge.reply", ReplyType=ReplyType, Reply=Reply)
+    _module("channel.chat_message", ChatMessage=ChatMessage)
+    _module("channel.wechat.wechat_channel", WechatChannel=WechatChannel)
+    _module("common.log", logger=logger)
+    _module("common.expired_dict", ExpiredDict=ExpiredDict)
+    _module("config", conf=lambda: CONF)
+    itchat = _module("lib.itchat", __path__=[], search_friends=lambda **kw: [], search_chatrooms=lambda **kw: [])
+    itchat.content = _module("lib.itchat.content", TEXT="Text", PICTURE="Picture", __all__=["TEXT", "PICTURE"])
+    sys.modules["lib"].itchat = itchat
+    _module("plugins", __path__=[], Event=Event, EventAction=EventAction, EventContext=EventContext,
+            Plugin=Plugin, register=register,
+            __all__=["Event", "EventAction", "EventContext", "Plugin", "register"])
+
+
+def set_log_level(level):
+    logging.getLogger("bench.cow").setLevel(level)
+
+
+class PluginSandbox:
+    """在临时目录中加载插件，退出时清理目录并关闭后台线程"""
+
+    def __init__(self, config):
+        self.config = config
+        self.workdir = None
+        self.plugin = None
+
+    def __enter__(self):
+        install()
+        self.workdir = tempfile.mkdtemp(prefix="mj-bench-")
+        plugin_dir = os.path.join(self.workdir, "plugins", "midjourney")
+        os.makedirs(plugin_dir)
+        for path in glob.glob(os.path.join(PLUGIN_DIR, "*.py")) + [os.path.join(PLUGIN_DIR, "config.json.template")]:
+            shutil.copy(path, plugin_dir)
+        with open(os.path.join(plugin_dir, "config.json.template"), encoding="utf-8") as f:
+            template = json.load(f)
+        with open(os.path.join(plugin_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({**template, **self.config}, f, ensure_ascii=False, indent=2)
+        sys.modules["plugins"].__path__ = [os.path.join(self.workdir, "plugins")]
+        module = importlib.import_module("plugins.midjourney.midjourney")
+        self.plugin = module.Midjourney()
+        return self
+
+    def message(self, content, user_id, type=ContextType.TEXT, group_id=None):
+        """构造一条消息的 EventContext"""
+        msg = ChatMessage(user_id, group_id=group_id, group_name=group_id and "group-" + group_id)
+        context = Context(type, content, {"msg": msg, "isgroup": group_id is not None})
+        return EventContext(Event.ON_HANDLE_CONTEXT, {"context": context, "channel": None})
+
+    def drain(self, timeout=60):
+        """等待提交队列中的任务全部执行完，再关闭数据库和代理"""
+        queue = self.plugin.submit_queue
+        deadline = time.time() + timeout
+        while queue.pending() and time.time() < deadline:
+            time.sleep(0.05)
+        # 每个工作线程领到一个屏障任务后阻塞，全部到齐说明之前的任务都已执行完
+        barrier = threading.Barrier(len(queue.threads) + 1, timeout=timeout)
+        for _ in queue.threads:
+            while not queue.submit(barrier.wait) and time.time() < deadline:
+                time.sleep(0.05)
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+
+    def __exit__(self, *exc):
+        plugin = self.plugin
+        if plugin is not None:
+            self.drain()
+            atexit.unregister(plugin.shutdown)
+            plugin.shutdown()
+            plugin.poll_executor.shutdown(wait=False)
+            if plugin.notify_hook:
+                plugin.notify_hook.shutdown()
+            if plugin.metrics_server:
+                plugin.metrics_server.shutdown()
+            plugin.proxy_pool.close()
+            plugin.task_store.close()
+            plugin.user_store.close()
+        for name in [n for n in sys.modules if n.startswith("plugins.midjourney")]:
+            del sys.modules[name]
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        return False
@@ -0,0 +1,298 @@
+# encoding:utf-8
+"""
+本地模拟的 midjourney-proxy，用于基准测试
+
+实现 /submit/imagine、/submit/action、/submit/modal、/submit/describe、/submit/shorten、
+/task/list-by-condition、/task/{id}/fetch、/task/{id}/image-seed，以及 /images/{id}.png 宫格图片。
+任务在提交后按设定的耗时推进进度，可配置接口延迟、任务耗时和错误率；提交时带 notifyHook 的任务完成后会回调。
+
+用法: python bench/fake_proxy.py [--port 8080] [--latency 0.05] [--complete 10] [--error-rate 0] [--fail-rate 0]
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+TILE_COLORS = ((214, 96, 77), (244, 165, 130), (146, 197, 222), (67, 147, 195))
+
+IMAGINE_BUTTONS = [
+    *({"customId": f"MJ::JOB::upsample::{i}::{{id}}", "label": f"U{i}", "emoji": ""} for i in range(1, 5)),
+    {"customId": "MJ::JOB::reroll::0::{id}::SOLO", "label": "", "emoji": "🔄"},
+    *({"customId": f"MJ::JOB::variation::{i}::{{id}}", "label": f"V{i}", "emoji": ""} for i in range(1, 5)),
+]
+UPSCALE_BUTTONS = [
+    {"customId": "MJ::JOB::upsample_v6_2x_subtle::1::{id}::SOLO", "label": "Upscale (Subtle)", "emoji": "upscale_1"},
+    {"customId": "MJ::JOB::low_variation::1::{id}::SOLO", "label": "Vary (Subtle)", "emoji": "🪄"},
+    {"customId": "MJ::Outpaint::50::1::{id}::SOLO", "label": "Zoom Out 2x", "emoji": "🔍"},
+]
+DESCRIBE_BUTTONS = [{"customId": f"MJ::Job::PicReader::{i}", "label": str(i), "emoji": ""} for i in range(1, 5)]
+
+
+def render_grid(side, seed=0):
+    """生成 2x2 宫格 PNG，每格带渐变和噪点，压缩和缩放开销接近真实出图"""
+    half = side // 2
+    grid = Image.new("RGB", (side, side))
+    rng = random.Random(seed)
+    for index, color in enumerate(TILE_COLORS):
+        gradient = Image.linear_gradient("L").resize((half, half)).rotate(90 * index)
+        tile = Image.merge("RGB", [gradient.point(lambda v, c=c: (v * c) // 255) for c in color])
+        noise = Image.effect_noise((half, half), 24).convert("RGB")
+        tile = Image.blend(tile, noise, 0.15)
+        draw = ImageDraw.Draw(tile)
+        for _ in range(12):
+            x, y = rng.randrange(half), rng.randrange(half)
+            r = rng.randrange(half // 16, half // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), outline=color[::-1], width=4)
+        grid.paste(tile, ((index % 2) * half, (index // 2) * half))
+    output = io.BytesIO()
+    grid.save(output, format="PNG")
+    return output.getvalue()
+
+
+class ProxyHTTPServer(ThreadingHTTPServer):
+    # 突发提交时默认的 5 个连接队列会被占满；只改子类，不影响同进程中插件自己的 HTTP 服务
+    request_queue_size = 128
+
+
+class FakeProxy:
+    """任务状态按提交时间推进：前 10% 排队，之后执行中，到达完成时间后成功或按失败率失败"""
+
+    def __init__(self, latency=0.05, jitter=0.5, complete=10.0, fast_complete=2.0, error_rate=0.0, fail_rate=0.0,
+                 image_side=1024, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.complete = complete
+        self.fast_complete = fast_complete
+        self.error_rate = error_rate
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.ids = itertools.count(int(time.time() * 1000))
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.image = render_grid(image_side)
+        self.stats = {"requests": 0, "errors": 0, "submits": 0, "images": 0}
+        self.server = None
+
+    # 请求处理
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency * (1 + self.jitter * (2 * self.random.random() - 1)))
+
+    def should_fail(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def submit(self, action, body, prompt="", image_url=True):
+        task_id = str(next(self.ids))
+        fast = action in ("DESCRIBE", "SHORTEN")
+        duration = (self.fast_complete if fast else self.complete) * (0.75 + 0.5 * self.random.random())
+        task = {
+            "id": task_id,
+            "action": action,
+            "prompt": prompt,
+            "promptEn": prompt,
+            "description": f"/{action.lower()} {prompt}".strip(),
+            "state": body.get("state", ""),
+            "submitTime": int(time.time() * 1000),
+            "failed": self.fail_rate > 0 and self.random.random() < self.fail_rate,
+            "duration": duration,
+            "image": image_url and not fast,
+            "notifyHook": body.get("notifyHook"),
+            "parent": body.get("taskId"),
+        }
+        with self.lock:
+            self.tasks[task_id] = task
+            self.stats["submits"] += 1
+        if task["notifyHook"]:
+            timer = threading.Timer(duration, self.notify, (task_id,))
+            timer.daemon = True
+            timer.start()
+        return {"code": 1, "description": "提交成功", "result": task_id, "properties": {}}
+
+    def view(self, task_id, base_url):
+        """按当前时间计算任务状态，返回与 midjourney-proxy 相同结构的任务信息"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        elapsed = time.time() - task["submitTime"] / 1000
+        done = elapsed >= task["duration"]
+        view = {k: task[k] for k in ("id", "action", "prompt", "promptEn", "description", "state", "submitTime")}
+        view.update({"startTime": None, "finishTime": None, "imageUrl": None, "failReason": None, "buttons": [],
+                     "properties": {"finalPrompt": task["prompt"]}})
+        if not done:
+            queued = elapsed < task["duration"] * 0.1
+            view["status"] = "SUBMITTED" if queued else "IN_PROGRESS"
+            view["progress"] = "0%" if queued else "%d%%" % min(99, 100 * elapsed / task["duration"])
+            return view
+        view["finishTime"] = int((task["submitTime"] / 1000 + task["duration"]) * 1000)
+        if task["failed"]:
+            view.update({"status": "FAILURE", "progress": "", "failReason": "[Banned prompt detected] simulated"})
+            return view
+        view.update({"status": "SUCCESS", "progress": "100%"})
+        if task["image"]:
+            view["imageUrl"] = f"{base_url}/images/{task_id}.png"
+        buttons = {"UPSCALE": UPSCALE_BUTTONS, "DESCRIBE": DESCRIBE_BUTTONS, "SHORTEN": DESCRIBE_BUTTONS}
+        view["buttons"] = [{**b, "customId": b["customId"].format(id=task_id)}
+                           for b in buttons.get(task["action"], IMAGINE_BUTTONS)]
+        if task["action"] in ("DESCRIBE", "SHORTEN"):
+            view["properties"]["finalPrompt"] = "\n\n".join(
+                f"{i}️⃣ {task['prompt'] or 'a painting'}, variant {i} --ar 1:1" for i in range(1, 5))
+        return view
+
+    def notify(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+        view = self.view(task_id, self.base_url())
+        try:
+            request = urllib.request.Request(task["notifyHook"], data=json.dumps(view).encode("utf-8"),
+                                             headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(request, timeout=5).close()
+        except OSError as e:
+            print(f"[fake_proxy] notify {task_id} failed: {e}", file=sys.stderr)
+
+    def handle(self, method, path, body):
+        """返回 (状态码, 响应内容, Content-Type)"""
+        with self.lock:
+            self.stats["requests"] += 1
+        if path.startswith("/images/"):
+            with self.lock:
+                self.stats["images"] += 1
+            return 200, self.image, "image/png"
+        self.delay()
+        if self.should_fail():
+            with self.lock:
+                self.stats["errors"] += 1
+            return 500, {"error": "simulated failure"}, None
+        if method == "POST":
+            if path == "/submit/imagine":
+                return 200, self.submit("IMAGINE", body, body.get("prompt", "")), None
+            if path == "/submit/action":
+                parent = self.view(body.get("taskId"), "")
+                if parent is None:
+                    return 200, {"code": 3, "description": "关联任务不存在或已失效"}, None
+                custom_id = body.get("customId", "")
+                action = "UPSCALE" if "::upsample::" in custom_id else (
+                    "REROLL" if "::reroll::" in custom_id else "VARIATION")
+                return 200, self.submit(action, body, parent["prompt"]), None
+            if path == "/submit/modal":
+                return 200, {"code": 1, "description": "提交成功", "result": body.get("taskId")}, None
+            if path == "/submit/describe":
+                return 200, self.submit("DESCRIBE", body), None
+            if path == "/submit/shorten":
+                return 200, self.submit("SHORTEN", body, body.get("prompt", "")), None
+            if path == "/task/list-by-condition":
+                base_url = self.base_url()
+                views = [self.view(task_id, base_url) for task_id in body.get("ids") or []]
+                return 200, [v for v in views if v], None
+        match = re.fullmatch(r"/task/([^/]+)/(fetch|image-seed)", path)
+        if method == "GET" and match:
+            view = self.view(match.group(1), self.base_url())
+            if match.group(2) == "fetch":
+                # 与 midjourney-proxy 一致，不存在的任务返回 200 空响应
+                return (200, view, None) if view else (200, b"", "application/json")
+            if view is None or view["status"] != "SUCCESS":
+                return 200, {"code": 3, "description": "任务未完成"}, None
+            return 200, {"code": 1, "description": "成功", "result": str(int(match.group(1)) % 4294967296)}, None
+        return 404, {"error": "not found"}, None
+
+    # 服务生命周期
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def dispatch(self, method):
+                body = {}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    try:
+                        body = json.loads(self.rfile.read(length))
+                    except ValueError:
+                        body = {}
+                status, content, content_type = proxy.handle(method, self.path.split("?")[0], body)
+                if content_type is None:
+                    content = json.dumps(content, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.dispatch("GET")
+
+            def do_POST(self):
+                self.dispatch("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ProxyHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-proxy", daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.05, help="接口平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="延迟的随机浮动比例")
+    parser.add_argument("--complete", type=float, default=10.0, help="绘图任务平均完成时间（秒）")
+    parser.add_argument("--fast-complete", type=float, default=2.0, help="describe/shorten 平均完成时间（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="接口返回 500 的比例")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="任务执行失败的比例")
+    parser.add_argument("--image-side", type=int, default=1024, help="宫格图片边长")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+
+
+def from_args(args):
+    return FakeProxy(args.latency, args.jitter, args.complete, args.fast_complete, args.error_rate, args.fail_rate,
+                     args.image_side, args.seed)
+
+
+def spawn(*options):
+    """在独立进程中启动模拟代理，返回 (进程, 监听地址)，压测的 CPU 和内存统计不包含代理一侧"""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--port", "0", *map(str, options)],
+                               stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 midjourney-proxy")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    proxy = from_args(args).start(args.host, args.port)
+    # 第一行输出监听地址，便于其他进程读取
+    print(proxy.base_url(), flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"[fake_proxy] {proxy.stats}", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        proxy.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# encoding:utf-8
+import threading
+import time
+from collections import deque
+
+from common.log import logger
+
+DEFAULT_CIRCUIT_CONF = {
+    "circuit_window": 20,  # 统计最近多少次调用
+    "circuit_min_calls": 5,  # 至少多少次调用后才判断错误率
+    "circuit_error_rate": 0.5,  # 失败（含慢调用）比例达到该值时熔断
+    "circuit_slow_seconds": 20,  # 超过该耗时的调用记为失败
+    "circuit_open_seconds": 30,  # 熔断后多久进入半开状态，放行一次探测
+    "circuit_probe_interval": 15,  # 后台健康探测间隔
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断期间直接拒绝调用"""
+
+
+class CircuitBreaker:
+    """按最近调用的失败率和耗时熔断，冷却后半开放行一次探测，探测成功后恢复"""
+
+    def __init__(self, name, config=None):
+        config = {**DEFAULT_CIRCUIT_CONF, **(config or {})}
+        self.name = name
+        self.window = deque(maxlen=config["circuit_window"])
+        self.min_calls = config["circuit_min_calls"]
+        self.error_rate = config["circuit_error_rate"]
+        self.slow_seconds = config["circuit_slow_seconds"]
+        self.open_seconds = config["circuit_open_seconds"]
+        self.state = CLOSED
+        self.opened_at = 0
+        self.trial = False  # 半开状态下是否已有探测请求
+        self.lock = threading.Lock()
+
+    def available(self, now=None):
+        """是否可以尝试调用（关闭状态，或已过冷却时间可以探测）"""
+        now = now or time.time()
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return now - self.opened_at >= self.open_seconds
+            return not self.trial
+
+    def allow(self, now=None):
+        """调用前检查，半开状态只放行一次探测"""
+        now = now or time.time()
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self.trial = False
+            if self.state == HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record(self, ok, elapsed, now=None):
+        now = now or time.time()
+        failed = not ok or elapsed > self.slow_seconds
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.trial = False
+                if failed:
+                    self.trip(now)
+                else:
+                    self.state = CLOSED
+                    self.window.clear()
+                    logger.info(f"[MJ] circuit {self.name} closed")
+                return
+            self.window.append(failed)
+            if self.state == CLOSED and len(self.window) >= self.min_calls \
+                    and sum(self.window) / len(self.window) >= self.error_rate:
+                self.trip(now)
+
+    def trip(self, now):
+        # 调用方需持有 self.lock
+        self.state = OPEN
+        self.opened_at = now
+        self.window.clear()
+        logger.warning(f"[MJ] circuit {self.name} opened, retry after {self.open_seconds}s")
@@ -0,0 +1,58 @@
+# encoding:utf-8
+import threading
+import time
+
+
+def normalize(text):
+    # 忽略大小写和多余空白，避免仅因格式不同而重复提交
+    return " ".join(str(text).split()).lower()
+
+
+class Coalescer:
+    """短时间内相同用户的相同指令只提交一次，重复的请求关联到已有任务"""
+
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> {"task_id": 任务ID或 None（排队中）, "expires": 过期时间}
+        self.task_keys = {}  # task_id -> key
+
+    def claim(self, key, now=None):
+        """新请求返回 None 并占位；窗口内的重复请求返回已有记录"""
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["expires"] > now:
+                return dict(entry)
+            self.prune(now)
+            self.entries[key] = {"task_id": None, "expires": now + self.ttl}
+        return None
+
+    def resolve(self, key, task_id):
+        """提交成功后记录任务ID"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["task_id"] = task_id
+                self.task_keys[task_id] = key
+
+    def release(self, key):
+        """提交失败或被拒绝时释放占位，允许立即重试"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and entry["task_id"]:
+                self.task_keys.pop(entry["task_id"], None)
+
+    def finish(self, task_id):
+        """任务结束后允许再次提交相同指令"""
+        with self.lock:
+            key = self.task_keys.pop(task_id, None)
+            if key is not None:
+                self.entries.pop(key, None)
+
+    def prune(self, now):
+        # 调用方需持有 self.lock
+        for key in [k for k, e in self.entries.items() if e["expires"] <= now]:
+            entry = self.entries.pop(key)
+            if entry["task_id"]:
+                self.task_keys.pop(entry["task_id"], None)
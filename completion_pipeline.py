@@ -0,0 +1,124 @@
+# encoding:utf-8
+import queue
+import threading
+import zlib
+
+from common.log import logger
+
+DEFAULT_PIPELINE_CONF = {
+    "image_process_workers": 2,  # 压缩结果图片的线程数，下载线程数为 image_fetch_workers
+    "delivery_workers": 4,  # 发送消息的线程数，同一接收者的消息固定由一个线程按顺序发送
+    "pipeline_queue_size": 100,  # 每个阶段最多排队的任务数，队列满时上游等待
+}
+
+
+class Completion:
+    """一个已完成（成功或失败）任务在流水线中的状态"""
+
+    def __init__(self, task, info, context, reply_prefix, needs_image=False):
+        self.task = task
+        self.info = info
+        self.context = context
+        self.reply_prefix = reply_prefix
+        self.needs_image = needs_image
+        self.digest = None
+        self.original = None  # 下载的原图数据
+        self.image = None  # 压缩后待发送的图片
+
+    @property
+    def receiver(self):
+        return self.context.get("receiver")
+
+
+class Stage:
+    """流水线的一个阶段：有界队列加固定数量的工作线程"""
+
+    def __init__(self, name, handler, workers, maxsize):
+        self.name = name
+        self.handler = handler
+        self.queue = queue.Queue(maxsize)
+        self.threads = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, name=f"mj-{name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def put(self, item):
+        # 队列满时阻塞调用方，下游处理不过来时上游自然放慢
+        self.queue.put(item)
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.exception(f"[MJ] {self.name} stage failed: {e}")
+
+
+class OrderedDelivery:
+    """发送线程池，按接收者分片，同一接收者的消息始终由同一线程按提交顺序发送"""
+
+    def __init__(self, workers, maxsize):
+        self.shards = [Stage(f"delivery-{i}", self._run, 1, maxsize) for i in range(max(1, workers))]
+
+    def submit(self, key, fn, *args):
+        shard = zlib.crc32(str(key).encode("utf-8")) % len(self.shards)
+        self.shards[shard].put((fn, args))
+
+    def pending(self):
+        return sum(shard.pending() for shard in self.shards)
+
+    @staticmethod
+    def _run(job):
+        fn, args = job
+        fn(*args)
+
+
+class CompletionPipeline:
+    """任务完成后的处理流水线：下载原图 -> 压缩 -> 发送，各阶段由有界队列连接
+
+    轮询和 notifyHook 只负责发现状态变化并提交 Completion，单个慢下载或慢发送不会阻塞其他任务。
+    fetch / process 返回 False 时跳过后续的图片阶段直接发送。
+    """
+
+    def __init__(self, fetch, process, deliver, config):
+        maxsize = config.get("pipeline_queue_size")
+        self.deliver = deliver
+        self.delivery = OrderedDelivery(config.get("delivery_workers"), maxsize)
+        self.process_stage = Stage("process", self._step(process, None), config.get("image_process_workers"), maxsize)
+        self.fetch_stage = Stage("fetch", self._step(fetch, self.process_stage), config.get("image_fetch_workers"),
+                                 maxsize)
+
+    def _step(self, handler, next_stage):
+        def run(completion):
+            try:
+                proceed = handler(completion)
+            except Exception as e:
+                logger.exception(f"[MJ] handle completion {completion.task.get('id')} failed: {e}")
+                proceed = False
+            if proceed and next_stage is not None:
+                next_stage.put(completion)
+            else:
+                self.delivery.submit(completion.receiver, self.deliver, completion)
+        return run
+
+    def submit(self, completion):
+        if completion.needs_image:
+            self.fetch_stage.put(completion)
+        else:
+            self.delivery.submit(completion.receiver, self.deliver, completion)
+
+    def send(self, receiver, fn, *args):
+        """不属于任务完成的消息（提交回执、切图等）也走发送线程，与同一接收者的结果消息保持顺序"""
+        self.delivery.submit(receiver, fn, *args)
+
+    def pending(self):
+        return {
+            "fetch": self.fetch_stage.pending(),
+            "process": self.process_stage.pending(),
+            "delivery": self.delivery.pending(),
+        }
@@ -258,15 +258,16 @@ def search_friends(name):
 def env_detection(self, e_context: EventContext):
     trigger_prefix = conf().get("plugin_trigger_prefix", "$")
     reply = None
+    userInfo = e_context["mj_user"]
     
     # 如果用户是管理员或者在白名单用户列表中，则不受限制
-    if self.userInfo["isadmin"] or self.userInfo["iswuser"]:
+    if userInfo["isadmin"] or userInfo["iswuser"]:
         return True
     
     # 如果用户不在白名单用户列表中且使用次数已用完
-    if not self.userInfo["limit"]:
+    if not userInfo["limit"]:
         # 检查是否在白名单群组中
-        if self.userInfo["iswgroup"]:
+        if userInfo["iswgroup"]:
             return True
         else:
             reply = Reply(ReplyType.ERROR, "[MJ] 您今日的使用次数已用完，请明日再来")
@@ -0,0 +1,193 @@
+# encoding:utf-8
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from common.log import logger
+
+DEFAULT_IMAGE_CACHE_CONF = {
+    "image_cache_enabled": True,
+    "image_cache_dir": "image_cache",
+    "image_cache_max_mb": 512,
+}
+
+ORIGINAL = "orig"
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def digest_of(name):
+    return name.split(".", 1)[0]
+
+
+class ImageCache:
+    """按内容哈希寻址的本地图片缓存，保存原图和压缩后的版本，超出容量时按 LRU 淘汰
+
+    objects/<内容哈希>.<版本> 保存图片内容，urls/<URL哈希> 记录 URL 对应的内容哈希，
+    某个内容哈希的所有版本都被淘汰后，指向它的 URL 映射一并删除。
+    文件先写临时文件再原子替换，并发读取不会读到半个文件。
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(path, "objects")
+        self.urls_dir = os.path.join(path, "urls")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.urls_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 文件名 -> 大小，越靠后越近使用
+        self.size = 0
+        self.versions = Counter()  # 内容哈希 -> 已缓存的版本数
+        self.url_keys = {}  # 内容哈希 -> 指向它的 URL 哈希
+        self.url_digests = {}  # URL 哈希 -> 内容哈希
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        # 启动时按修改时间恢复 LRU 顺序，命中时会更新文件修改时间
+        files = []
+        for name in os.listdir(self.objects_dir):
+            full = os.path.join(self.objects_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(full)
+                continue
+            st = os.stat(full)
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+            self.versions[digest_of(name)] += 1
+        # 清理指向已不存在内容的 URL 映射
+        for key in os.listdir(self.urls_dir):
+            full = os.path.join(self.urls_dir, key)
+            if key.endswith(".tmp"):
+                os.remove(full)
+                continue
+            with open(full, encoding="utf-8") as f:
+                digest = f.read().strip()
+            if self.versions[digest]:
+                self.add_url(key, digest)
+            else:
+                os.remove(full)
+        with self.lock:
+            self.evict()
+        logger.info(f"[MJ] image cache loaded, {len(self.entries)} files, {len(self.url_digests)} urls, {self.size} bytes")
+
+    def lookup(self, url):
+        """返回 URL 对应的内容哈希，未缓存返回 None"""
+        try:
+            with open(os.path.join(self.urls_dir, url_key(url)), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def get(self, digest, version=ORIGINAL, count=True):
+        """读取缓存内容；同一次查找的后续探测传 count=False，只统计一次命中或未命中"""
+        name = f"{digest}.{version}"
+        full = os.path.join(self.objects_dir, name)
+        with self.lock:
+            known = name in self.entries
+            if known:
+                self.entries.move_to_end(name)
+        data = None
+        if known:
+            try:
+                with open(full, "rb") as f:
+                    data = f.read()
+                os.utime(full)
+            except FileNotFoundError:
+                # 读取期间被淘汰
+                data = None
+        if count:
+            with self.lock:
+                if data is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return data
+
+    def get_url(self, url, version=ORIGINAL):
+        digest = self.lookup(url)
+        if digest is None:
+            with self.lock:
+                self.misses += 1
+            return None, None
+        return digest, self.get(digest, version)
+
+    def put_original(self, url, data):
+        """保存原图并记录 URL 映射，返回内容哈希"""
+        digest = hashlib.sha256(data).hexdigest()
+        self.put(digest, ORIGINAL, data)
+        key = url_key(url)
+        self.write_file(os.path.join(self.urls_dir, key), digest.encode("utf-8"))
+        with self.lock:
+            if self.versions[digest]:
+                self.add_url(key, digest)
+            else:
+                # 写入映射前内容已被淘汰
+                old = self.url_digests.pop(key, None)
+                if old is not None:
+                    self.url_keys[old].discard(key)
+                self.remove_url(key)
+        return digest
+
+    def put(self, digest, version, data):
+        name = f"{digest}.{version}"
+        self.write_file(os.path.join(self.objects_dir, name), data)
+        with self.lock:
+            if name in self.entries:
+                self.size -= self.entries.pop(name)
+            else:
+                self.versions[digest] += 1
+            self.entries[name] = len(data)
+            self.size += len(data)
+            self.evict()
+
+    def write_file(self, full, data):
+        tmp = f"{full}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, full)
+
+    def add_url(self, key, digest):
+        # 调用方需持有 self.lock（load 时除外）；同一 URL 的内容变化时从旧哈希下移除
+        old = self.url_digests.get(key)
+        if old is not None and old != digest:
+            self.url_keys[old].discard(key)
+        self.url_digests[key] = digest
+        self.url_keys.setdefault(digest, set()).add(key)
+
+    def remove_url(self, key):
+        try:
+            os.remove(os.path.join(self.urls_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        # 调用方需持有 self.lock；内容的最后一个版本被淘汰时删除指向它的 URL 映射
+        while self.size > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.objects_dir, name))
+            except FileNotFoundError:
+                pass
+            digest = digest_of(name)
+            self.versions[digest] -= 1
+            if self.versions[digest] > 0:
+                continue
+            del self.versions[digest]
+            for key in self.url_keys.pop(digest, ()):
+                if self.url_digests.get(key) == digest:
+                    del self.url_digests[key]
+                    self.remove_url(key)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "files": len(self.entries), "urls": len(self.url_digests),
+                    "bytes": self.size}
@@ -0,0 +1,79 @@
+# encoding:utf-8
+import io
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.log import logger
+from .metrics import IMAGE_DOWNLOAD
+
+# 默认的图片下载配置，可在 config.json 中覆盖
+DEFAULT_IMAGE_FETCH_CONF = {
+    "image_fetch_workers": 4,  # 完成流水线中下载图片的线程数
+    "image_connect_timeout": 5,
+    "image_read_timeout": 20,
+    "image_download_timeout": 60,  # 单张图片下载的总时长上限，包含重试
+    "image_chunk_size": 64 * 1024,
+    "image_retry_total": 3,
+    "image_retry_backoff": 1,
+}
+
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class ImageFetcher:
+    """复用连接池的 CDN 图片下载器，由完成流水线的多个下载线程共用"""
+
+    def __init__(self, config=None):
+        config = {**DEFAULT_IMAGE_FETCH_CONF, **(config or {})}
+        workers = config["image_fetch_workers"]
+        self.timeout = (config["image_connect_timeout"], config["image_read_timeout"])
+        self.download_timeout = config["image_download_timeout"]
+        self.chunk_size = config["image_chunk_size"]
+        self.retry_total = config["image_retry_total"]
+        self.retry_backoff = config["image_retry_backoff"]
+        # 重试在 fetch 中进行，每次尝试的超时按剩余时间收紧，保证总时长不超过 image_download_timeout
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers * 2, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, img_url):
+        """下载图片并返回 BytesIO，失败或超过总时长时抛出 requests 异常"""
+        start = time.time()
+        deadline = start + self.download_timeout
+        attempt = 0
+        while True:
+            try:
+                image_storage = self.fetch_once(img_url, deadline)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                attempt += 1
+                status = e.response.status_code if e.response is not None else None
+                wait = self.retry_backoff * 2 ** (attempt - 1)
+                if (attempt > self.retry_total or (status is not None and status not in RETRY_STATUS)
+                        or time.time() + wait >= deadline):
+                    raise
+                logger.debug(f"[MJ] image download retry {attempt} in {wait}s: {e}")
+                time.sleep(wait)
+        IMAGE_DOWNLOAD.observe(time.time() - start)
+        logger.debug("[MJ] downloaded %s bytes in %.3fs", image_storage.getbuffer().nbytes, time.time() - start)
+        return image_storage
+
+    def fetch_once(self, img_url, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout(f"download exceeded {self.download_timeout}s")
+        # 单次读操作的等待也不能超过剩余时间
+        timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+        with self.session.get(img_url, stream=True, timeout=timeout) as pic_res:
+            pic_res.raise_for_status()  # 如果返回错误码, 则抛出异常
+            image_storage = io.BytesIO()
+            for block in pic_res.iter_content(self.chunk_size):
+                image_storage.write(block)
+                if time.time() > deadline:
+                    raise requests.exceptions.Timeout(f"download exceeded {self.download_timeout}s")
+        image_storage.seek(0)
+        return image_storage
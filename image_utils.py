@@ -0,0 +1,74 @@
+# encoding:utf-8
+import io
+
+from PIL import Image, ImageOps
+
+from common.log import logger
+
+DEFAULT_UPLOAD_CONF = {
+    "upload_preprocess_enabled": True,
+    "upload_max_side": 1536,  # 参考图最长边，0 表示不缩放
+    "upload_format": "JPEG",  # JPEG / WEBP / PNG
+    "upload_quality": 85,
+}
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+
+def prepare_upload(img_data, max_side=1536, fmt="JPEG", quality=85):
+    """缩小并重新编码用户上传的参考图，去掉 EXIF 等元数据，返回 (图片数据, MIME 类型)"""
+    fmt = fmt.upper()
+    image = Image.open(io.BytesIO(img_data))
+    # 先按 EXIF 方向旋转，重新编码时不会保留 EXIF
+    image = ImageOps.exif_transpose(image)
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if fmt == "JPEG":
+        if has_alpha:
+            # JPEG 不支持透明通道，铺白底
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    output = io.BytesIO()
+    if fmt == "PNG":
+        image.save(output, format=fmt, optimize=True)
+    else:
+        image.save(output, format=fmt, quality=quality)
+    return output.getvalue(), MIME_TYPES.get(fmt, "image/" + fmt.lower())
+
+
+def guess_mime(img_data):
+    """无法重新编码时，按原图格式标注 MIME 类型"""
+    try:
+        return MIME_TYPES.get(Image.open(io.BytesIO(img_data)).format, "image/png")
+    except Exception as e:
+        logger.warning(f"[MJ] unknown image format: {e}")
+        return "image/png"
+
+
+def split_grid(img_data, max_size=(1024, 1024)):
+    """把 2x2 宫格图切成四张单图，按 1-4（左上、右上、左下、右下）顺序返回"""
+    grid = Image.open(io.BytesIO(img_data))
+    fmt = grid.format or "PNG"
+    width, height = grid.size
+    half_w, half_h = width // 2, height // 2
+    tiles = []
+    for top, left in ((0, 0), (0, half_w), (half_h, 0), (half_h, half_w)):
+        tile = grid.crop((left, top, left + half_w, top + half_h))
+        tile.thumbnail(max_size)
+        output = io.BytesIO()
+        tile.save(output, format=fmt)
+        output.seek(0)
+        tiles.append(output)
+    return tiles
@@ -0,0 +1,209 @@
+# encoding:utf-8
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.log import logger
+
+DEFAULT_METRICS_CONF = {
+    "metrics_enabled": False,
+    "metrics_host": "127.0.0.1",
+    "metrics_port": 9108,
+    "metrics_path": "/metrics",
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [f"{self.name}{format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value, *labels):
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 2)
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for labels, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(names, labels + ('+Inf',))} {data[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {data[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {data[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Gauge(_Metric):
+    """采集时调用回调函数取值，回调返回数值或 {标签值元组: 数值}"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = None
+
+    def set_function(self, callback):
+        self.callback = callback
+
+    def render(self):
+        if self.callback is None:
+            return []
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"[MJ] gauge {self.name} failed: {e}")
+            return []
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return self.header() + [f"{self.name}{format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SUBMISSIONS = REGISTRY.register(Counter(
+    "mj_submissions_total", "Submissions by command and proxy result code", ("command", "code")))
+REJECTIONS = REGISTRY.register(Counter(
+    "mj_submit_rejections_total", "Submissions answered without calling the proxy", ("reason",)))
+PROXY_LATENCY = REGISTRY.register(Histogram(
+    "mj_proxy_request_seconds", "Proxy call latency per endpoint", ("endpoint", "outcome")))
+POLL_CYCLE = REGISTRY.register(Histogram(
+    "mj_poll_cycle_seconds", "Duration of one task polling cycle"))
+IMAGE_DOWNLOAD = REGISTRY.register(Histogram(
+    "mj_image_download_seconds", "Result image download time"))
+IMAGE_COMPRESS = REGISTRY.register(Histogram(
+    "mj_image_compress_seconds", "Result image compression time"))
+TASK_LATENCY = REGISTRY.register(Histogram(
+    "mj_task_delivery_seconds", "Time from submission to result delivery", ("action", "status")))
+INFLIGHT_TASKS = REGISTRY.register(Gauge(
+    "mj_inflight_tasks", "Tasks being tracked by the poller"))
+PENDING_COMMANDS = REGISTRY.register(Gauge(
+    "mj_pending_image_commands", "Users waiting to send an image for /img2img or /describe"))
+SUBMIT_QUEUE = REGISTRY.register(Gauge(
+    "mj_submit_queue_size", "Submissions waiting for a worker"))
+PROXY_SLOTS = REGISTRY.register(Gauge(
+    "mj_proxy_active_jobs", "Jobs running on each proxy account", ("account",)))
+PIPELINE_QUEUE = REGISTRY.register(Gauge(
+    "mj_completion_queue_size", "Completed tasks waiting in each pipeline stage", ("stage",)))
+
+
+class MetricsServer:
+    """以 Prometheus 文本格式暴露指标的轻量 HTTP 服务"""
+
+    def __init__(self, host, port, path, registry=REGISTRY):
+        self.path = path
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("[MJ] metrics: " + format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mj-metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info("[MJ] metrics listening on %s:%s%s", *self.server.server_address[:2], self.path)
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
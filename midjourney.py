@@ -2,8 +2,11 @@
 from re import S
 import threading
 
+import functools
 import json
+import secrets
 import time
+import math
 import requests
 import base64
 import os
@@ -11,6 +14,7 @@ import io
 import logging
 import traceback
 import plugins
+from concurrent.futures import ThreadPoolExecutor
 
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
@@ -30,14 +34,50 @@ from lib.itchat.content import *
 
 from plugins import *
 from .ctext import *
+from .proxy_client import DEFAULT_PROXY_CONF
+from .proxy_pool import ProxyPool, DEFAULT_POOL_CONF
+from .circuit_breaker import CircuitOpenError, DEFAULT_CIRCUIT_CONF
+from .submit_queue import SubmitQueue
+from .rate_limiter import RateLimiter, DEFAULT_RATE_LIMIT_CONF
+from .coalescer import Coalescer, normalize
+from .result_cache import ResultCache, image_dhash, DEFAULT_RESULT_CACHE_CONF
+from .task_cache import TaskCache
+from .task_poller import TaskPoller, DEFAULT_POLL_INTERVALS
+from .task_store import TaskStore
+from .user_store import UserStore
+from .roll_index import RollIndex
+from .tracing import Tracer
+from .router import CommandRouter, Route
+from .notify_hook import NotifyHookServer, with_token
+from .metrics import (MetricsServer, DEFAULT_METRICS_CONF, SUBMISSIONS, REJECTIONS, POLL_CYCLE, IMAGE_COMPRESS,
+                      TASK_LATENCY, INFLIGHT_TASKS, PENDING_COMMANDS, SUBMIT_QUEUE, PROXY_SLOTS, PIPELINE_QUEUE)
+from .completion_pipeline import CompletionPipeline, Completion, DEFAULT_PIPELINE_CONF
+from .image_fetcher import ImageFetcher, DEFAULT_IMAGE_FETCH_CONF
+from .image_cache import ImageCache, DEFAULT_IMAGE_CACHE_CONF
+from .image_utils import prepare_upload, guess_mime, split_grid, DEFAULT_UPLOAD_CONF
 
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 import signal
 import sys
 import atexit
 
+# 代理熔断期间的快速回复
+DEGRADED_TEXT = '⚠️ 绘图服务暂时不可用，正在自动恢复，请稍后再试'
+# 发送给用户的结果图尺寸及其在本地缓存中的版本名
+RESULT_IMAGE_SIZE = (800, 800)
+RESULT_IMAGE_VERSION = "800x800"
+# 没有待查询任务时轮询线程的最长休眠时间，到期后清理超时任务
+POLL_IDLE_SECONDS = 30
+
+
+def roll_locked(handler):
+    """修改名单或配置的处理函数逐个执行，只读指令不加锁"""
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        with self.roll_lock:
+            return handler(self, *args, **kwargs)
+    return wrapper
+
 
 @plugins.register(
     name="Midjourney",
@@ -61,7 +101,36 @@ class Midjourney(Plugin):
                 "proxy_server": "",
                 "proxy_api_secret": "",
                 "mj_admin_password": "12345678",
-                "daily_limit": 10
+                "daily_limit": 10,
+                "submit_workers": 4,
+                "submit_queue_size": 50,
+                "poll_tick": 1,
+                "poll_intervals": DEFAULT_POLL_INTERVALS,
+                "poll_near_done_progress": 80,
+                "poll_chunk_size": 50,
+                "trace_enabled": False,
+                "trace_path": "mj_trace.jsonl",
+                "poll_chunk_workers": 4,
+                "notify_hook_enabled": False,
+                "notify_hook_url": "",
+                "notify_hook_host": "127.0.0.1",
+                "notify_hook_port": 8089,
+                "notify_hook_path": "/mj/notify",
+                "notify_hook_secret": "",  # 回调地址携带的口令，留空时自动生成并写入配置
+                "notify_safety_poll_interval": 60,
+                "split_tile_max_side": 1024,
+                "dedup_ttl": 120,
+                "task_cache_size": 2000,
+                **DEFAULT_PROXY_CONF,
+                **DEFAULT_POOL_CONF,
+                **DEFAULT_CIRCUIT_CONF,
+                **DEFAULT_METRICS_CONF,
+                **DEFAULT_IMAGE_FETCH_CONF,
+                **DEFAULT_PIPELINE_CONF,
+                **DEFAULT_IMAGE_CACHE_CONF,
+                **DEFAULT_UPLOAD_CONF,
+                **DEFAULT_RATE_LIMIT_CONF,
+                **DEFAULT_RESULT_CACHE_CONF
             }
 
             # 配置文件路径
@@ -69,6 +138,8 @@ class Midjourney(Plugin):
             self.json_path = os.path.join(curdir, "config.json")
             self.roll_path = os.path.join(curdir, "user_info.pkl")
             self.user_datas_path = os.path.join(curdir, "user_datas.pkl")
+            self.task_db_path = os.path.join(curdir, "mj_tasks.db")
+            self.user_db_path = os.path.join(curdir, "mj_users.db")
             tm_path = os.path.join(curdir, "config.json.template")
 
             # 加载配置文件或模板
@@ -93,17 +164,104 @@ class Midjourney(Plugin):
             self.mj_admin_password = gconf.get("mj_admin_password")           
             self.proxy_server = gconf.get("proxy_server")
             self.proxy_api_secret = gconf.get("proxy_api_secret")
+            # 代理账号池，单账号配置时只有一个 default 账号
+            self.proxy_pool = ProxyPool(gconf)
+            # 结果图片下载复用同一个 CDN 连接池
+            self.image_fetcher = ImageFetcher(gconf)
+            # 本地图片缓存，重复发送同一结果时不再访问 CDN
+            self.image_cache = None
+            if gconf.get("image_cache_enabled"):
+                self.image_cache = ImageCache(os.path.join(curdir, gconf.get("image_cache_dir")),
+                                              gconf.get("image_cache_max_mb") * 1024 * 1024)
+            # 可选的分阶段耗时追踪，关闭时几乎没有开销
+            self.tracer = Tracer(os.path.join(curdir, gconf.get("trace_path")), gconf.get("trace_enabled"))
+
+            # 初始化用户数据，旧版 pickle 文件在首次启动时导入
+            self.user_store = UserStore(self.user_db_path)
+            self.user_store.migrate_pickles(self.user_datas_path, self.roll_path)
+            self.roll = self.user_store.load_roll()
+            self.roll_index = RollIndex(self.roll)
+            self.user_datas = self.user_store.load_users()
+            logger.debug(f"[MJ] Loaded user_datas: {len(self.user_datas)} users")
             
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context 
+            self.init_router()
             self.channel = WechatChannel()
-            self.task_id_dict = ExpiredDict(60 * 60)
+            # 任务完成后的下载、压缩和发送在独立的线程中分阶段进行，轮询只负责发现状态变化
+            self.pipeline = CompletionPipeline(self.fetch_result_image, self.process_result_image,
+                                               self.deliver_completion, gconf)
+            poll_intervals = gconf.get("poll_intervals")
+            self.notify_hook = None
+            self.notify_hook_url = ""
+            if gconf.get("notify_hook_enabled") and not gconf.get("notify_hook_url"):
+                logger.warning("[MJ] notify_hook_url is empty, notify hook disabled, fallback to polling")
+            elif gconf.get("notify_hook_enabled"):
+                # 由代理回调推送任务状态，轮询只作为兜底的慢速巡检；服务在初始化完成后才开始处理回调
+                if not gconf.get("notify_hook_secret"):
+                    gconf["notify_hook_secret"] = secrets.token_urlsafe(16)
+                try:
+                    self.notify_hook = NotifyHookServer(gconf.get("notify_hook_host"), gconf.get("notify_hook_port"),
+                                                        gconf.get("notify_hook_path"), gconf.get("notify_hook_secret"),
+                                                        self.handle_task_update)
+                    self.notify_hook_url = with_token(gconf.get("notify_hook_url"), gconf.get("notify_hook_secret"))
+                    poll_intervals = {k: gconf.get("notify_safety_poll_interval") for k in DEFAULT_POLL_INTERVALS}
+                except OSError as e:
+                    logger.error(f"[MJ] notify hook start failed, fallback to polling: {e}")
+            self.task_store = TaskStore(self.task_db_path)
+            self.task_poller = TaskPoller(poll_intervals, gconf.get("poll_near_done_progress"), store=self.task_store,
+                                          on_expire=self.on_task_expire)
+            # 重启前未完成的任务继续占用所属账号的槽位
+            for task_id, info in list(self.task_poller.tasks.items()):
+                # 旧版数据没有账号信息，归到第一个账号
+                info["account"] = self.proxy_pool.acquire(info.get("account") or self.proxy_pool.names()[0])
+                self.proxy_pool.assign(task_id, info["account"])
+            self.poll_executor = ThreadPoolExecutor(max_workers=gconf.get("poll_chunk_workers"), thread_name_prefix="mj-poll")
             self.cmd_dict = ExpiredDict(60 * 60)
-            
-
+            # 消息处理线程和任务完成线程共享的状态各自加锁，顺序为 roll_lock -> user_lock
+            self.cmd_lock = threading.Lock()
+            self.user_lock = threading.RLock()
+            self.roll_lock = threading.RLock()
+            # 已完成任务的元数据，/up、/seed、/split 优先从这里读取
+            self.task_cache = TaskCache(gconf.get("task_cache_size"))
+            self.submit_queue = SubmitQueue(gconf.get("submit_workers"), gconf.get("submit_queue_size"))
+            # 合并短时间内的重复提交，dedup_ttl 为 0 时关闭
+            self.coalescer = Coalescer(gconf.get("dedup_ttl")) if gconf.get("dedup_ttl") else None
+            # /describe 和 /shorten 的结果缓存
+            self.result_cache = None
+            if gconf.get("result_cache_enabled"):
+                self.result_cache = ResultCache(gconf.get("result_cache_size"), gconf.get("result_cache_ttl"))
+            self.rate_limiter = None
+            if gconf.get("rate_limit_enabled"):
+                self.rate_limiter = RateLimiter(gconf.get("user_rate_per_min"), gconf.get("user_burst"),
+                                                gconf.get("group_rate_per_min"), gconf.get("group_burst"))
+            if self.notify_hook:
+                self.notify_hook.start()
+
+
+            # 可选的 Prometheus 指标接口
+            INFLIGHT_TASKS.set_function(lambda: len(self.task_poller))
+            PENDING_COMMANDS.set_function(lambda: len(self.cmd_dict))
+            SUBMIT_QUEUE.set_function(self.submit_queue.pending)
+            PROXY_SLOTS.set_function(lambda: {(name,): active for name, (active, _) in self.proxy_pool.load().items()})
+            PIPELINE_QUEUE.set_function(lambda: {(stage,): size for stage, size in self.pipeline.pending().items()})
+            self.metrics_server = None
+            if gconf.get("metrics_enabled"):
+                try:
+                    self.metrics_server = MetricsServer(gconf.get("metrics_host"), gconf.get("metrics_port"),
+                                                        gconf.get("metrics_path"))
+                    self.metrics_server.start()
+                except OSError as e:
+                    logger.error(f"[MJ] metrics server start failed: {e}")
+
+            # 任务轮询在独立线程中进行，每轮结束后睡到最早的任务到期，慢查询只会推迟下一轮
+            self.poll_stop = threading.Event()
+            self.poll_thread = threading.Thread(target=self.poll_loop, name="mj-poll-loop", daemon=True)
+            self.poll_thread.start()
 
             # 创建调度器
             self.scheduler = BlockingScheduler()
-            self.scheduler.add_job(self.query_task_result, 'interval', seconds=10)
+            # 代理熔断后定期探测，恢复后自动关闭熔断
+            self.scheduler.add_job(self.proxy_pool.probe, 'interval', seconds=gconf.get("circuit_probe_interval"))
             logging.getLogger('apscheduler').setLevel(logging.WARNING)
 
             # 创建并启动一个新的线程来运行调度器
@@ -111,33 +269,12 @@ class Midjourney(Plugin):
             self.scheduler_thread.start()
 
             # 注册程序退出时的清理函数，确保调度器能够优雅关闭
-            atexit.register(self.graceful_shutdown)
+            atexit.register(self.shutdown)
 
             # 重新写入合并后的配置文件
             write_file(self.json_path, self.config)
             
 
-            # 初始化用户数据
-            self.roll = {
-                "mj_admin_users": [],
-                "mj_groups": [],
-                "mj_users": [],
-                "mj_bgroups": [],
-                "mj_busers": []
-            }
-            if os.path.exists(self.roll_path):
-                sroll = read_pickle(self.roll_path)
-                self.roll = {**self.roll, **sroll}
-
-            # 写入用户列表
-            write_pickle(self.roll_path, self.roll)
-
-            # 初始化用户数据
-            self.user_datas = {}
-            if os.path.exists(self.user_datas_path):
-                self.user_datas = read_pickle(self.user_datas_path)
-                logger.debug(f"[MJ] Loaded user_datas: {self.user_datas}")
-
             self.ismj = True  # 机器人是否运行中
 
             logger.info("[MJ] inited")
@@ -150,16 +287,38 @@ class Midjourney(Plugin):
     # 优雅关闭调度器的函数
     def graceful_shutdown(self, signum, frame):
         logger.info(f"收到信号 {signum}，正在优雅关闭调度器...")
-        self.scheduler.shutdown(wait=False)  # 关闭调度器
-        logger.info("调度器已关闭")
+        self.shutdown()
         sys.exit(0)  # 正常退出程序
 
-    def get_help_text(self, **kwargs):
-        # 获取用户的剩余使用次数
-        remaining_uses = self.userInfo.get('limit', '未知')
+    # 程序退出时由 atexit 调用，只停止轮询线程和调度器
+    def shutdown(self):
+        self.stop_polling()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)  # 关闭调度器
+        logger.info("调度器已关闭")
+
+    def init_router(self):
+        # 启动时把指令别名编译成路由表，每个指令对应独立的处理函数
+        self.router = CommandRouter(self.trigger_prefix)
+        for name, info in COMMANDS.items():
+            self.router.add_command(info["alias"], name, getattr(self, "cmd_" + name))
+        for name, info in ADMIN_COMMANDS.items():
+            self.router.add_command(info["alias"], name, getattr(self, "cmd_" + name), admin=True)
+        self.router.add_slash("/imagine", self.on_imagine)
+        self.router.add_slash("/up", self.on_up)
+        self.router.add_slash("/img2img", self.on_img2img)
+        self.router.add_slash("/describe", self.on_describe, with_args=False)
+        self.router.add_slash("/shorten", self.on_shorten)
+        self.router.add_slash("/seed", self.on_seed)
+        self.router.add_slash("/split", self.on_split)
+        self.image_route = Route("image", "image", self.on_image, False, "")
+
+    def get_help_text(self, user_info=None, **kwargs):
+        # 获取用户的剩余使用次数，框架直接调用时没有用户信息
+        remaining_uses = user_info.get('limit', '未知') if user_info else '未知'
 
         # 生成普通用户的帮助文本
-        help_text = f"这是一个能调用midjourney实现ai绘图的扩展能力。\n今日剩余使用次数：{remaining_uses}\n使用说明:\n/imagine 根据给出的提示词绘画;\n/img2img 根据提示词+垫图生成图;\n/up 任务ID 序号执行动作;\n/describe 图片转文字;\n/shorten 提示词分析;\n/seed 获取任务图片的seed值;\n\n注意，使用本插件请避免政治、色情、名人等相关提示词，监测到则可能存在停止使用风险。"
+        help_text = f"这是一个能调用midjourney实现ai绘图的扩展能力。\n今日剩余使用次数：{remaining_uses}\n使用说明:\n/imagine 根据给出的提示词绘画;\n/img2img 根据提示词+垫图生成图;\n/up 任务ID 序号执行动作;\n/describe 图片转文字;\n/shorten 提示词分析;\n/seed 获取任务图片的seed值;\n/split 任务ID [序号] 本地切分宫格图预览单张，不消耗次数;\n\n注意，使用本插件请避免政治、色情、名人等相关提示词，监测到则可能存在停止使用风险。"
 
         # 如果是管理员，附加管理员指令的帮助信息
         if kwargs.get("admin", False) is True:
@@ -177,234 +336,39 @@ class Midjourney(Plugin):
 
 
     def on_handle_context(self, e_context: EventContext):
+        context = e_context["context"]
+        # 快速排除与插件无关的消息，只有匹配到指令的消息才继续处理
+        if context.type == ContextType.TEXT:
+            route = self.router.match(context.content)
+        elif context.type == ContextType.IMAGE:
+            route = self.image_route if context["msg"].actual_user_id in self.cmd_dict else None
+        else:
+            return
+        if route is None:
+            return
         try:
-            if not isinstance(self.user_datas, dict):
-                logger.error(f"Expected self.user_datas to be a dictionary, but got {type(self.user_datas)}")
-
-            if e_context["context"].type not in [ContextType.TEXT, ContextType.IMAGE]:
-                return
-            context = e_context["context"]
-            content = context.content
-
-            logger.debug(f"[MJ] on_handle_context. content={content}")
-            msg: ChatMessage = context["msg"]
-            
-
-            if ContextType.TEXT == context.type and content.startswith(self.trigger_prefix):
-                
-                self.userInfo = self.get_user_info(e_context)
-                if not isinstance(self.userInfo, dict):
-                    logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                self.isgroup = self.userInfo["isgroup"]
-                
-                # 拦截非白名单黑名单群组
-                if not self.userInfo["isadmin"] and self.isgroup and not self.userInfo["iswgroup"] and self.userInfo["isbgroup"]:
-                    logger.debug("[MJ] Blocked by group whitelist/blacklist.")
+            logger.debug("[MJ] on_handle_context. content=%s", context.content)
+            # 用户信息只属于当前消息，随 e_context 传给各处理函数，不保存在插件实例上，多个消息可并发处理
+            with self.tracer.span("user_lookup"):
+                user_info = self.get_user_info(e_context)
+            logger.debug("[MJ] userInfo: %s", user_info)
+            e_context["mj_user"] = user_info
+            if route.kind == "command":
+                if self.is_blocked(user_info):
                     return
+                return self.handle_command(e_context, route)
 
-                # 拦截黑名单用户
-                if not self.userInfo["isadmin"] and self.userInfo["isbuser"]:
-                    logger.debug("[MJ] Blocked by user blacklist.")
-                    return
-                
-                else:
-                    return self.handle_command(e_context)
-
-
-
-            if not e_context["context"]["isgroup"]:
-                state = "u:" + msg.other_user_id + ":" + msg.other_user_nickname
-            else:
-                state = "r:" + msg.other_user_id + ":" + msg.actual_user_nickname
-            result = None
             try:
-
-                if content.startswith("/imagine "):
-                    
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS
-                        return                   
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    self.isgroup = self.userInfo["isgroup"]
-                    #用户资格判断
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return
-                    
-                    result = self.handle_imagine(content[9:], state)
-                elif content.startswith("/up "):
-
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已暂停，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS
-                        return                          
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    self.isgroup = self.userInfo["isgroup"]
-                    #用户资格判断
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return                    
-                    
-                    arr = content[4:].split()
-                    try:
-                        task_id = arr[0]
-                        index = int(arr[1])
-                    except Exception as e:
-                        e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 参数错误')
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                    # 获取任务
-                    task = self.get_task(task_id)
-                    if task is None:
-                        e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 任务ID不存在')
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                    if index > len(task['buttons']):
-                        e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 按钮序号不正确')
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                    # 获取按钮
-                    button = task['buttons'][index - 1]
-                    if button['label'] == 'Custom Zoom':
-                        e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 暂不支持自定义变焦')
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                    result = self.post_json('/submit/action',
-                                            {'customId': button['customId'], 'taskId': task_id, 'state': state})
-                    if result.get("code") == 21:
-                        result = self.post_json('/submit/modal',
-                                            {'taskId': result.get("result"), 'state': state})
-                elif content.startswith("/img2img "):
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS                        
-                        return                          
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    self.isgroup = self.userInfo["isgroup"]
-                    #用户资格判断
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return                    
-                    
-                    self.cmd_dict[msg.actual_user_id] = content
-                    e_context["reply"] = Reply(ReplyType.TEXT, '请给我发一张图片作为垫图')
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                elif content == "/describe":
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS                        
-                        return      
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    #用户资格判断
-                    self.isgroup = self.userInfo["isgroup"]
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return        
-
-                    self.cmd_dict[msg.actual_user_id] = content
-                    e_context["reply"] = Reply(ReplyType.TEXT, '请给我发一张图片用于图生文')
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                elif content.startswith("/shorten "):
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS                        
-                        return      
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    self.isgroup = self.userInfo["isgroup"]
-                    #用户资格判断
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return        
-
-                    result = self.handle_shorten(content[9:], state)
-                elif content.startswith("/seed "):
-                    # 判断是否在运行中
-                    if not self.ismj:
-                        e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
-                        e_context.action = EventAction.BREAK_PASS                        
-                        return      
-                    #前缀开头匹配才记录用户信息以免太多不相关的用户被记录
-                    self.userInfo = self.get_user_info(e_context)
-                    if not isinstance(self.userInfo, dict):
-                        logger.error(f"Expected self.userInfo to be a dictionary, but got {type(self.userInfo)}")
-                    logger.debug(f"[MJ] userInfo: {self.userInfo}")
-                    self.isgroup = self.userInfo["isgroup"]
-                    #用户资格判断
-                    env = env_detection(self, e_context)
-                    if not env:
-                        return        
-
-                    task_id = content[6:]
-                    result = self.get_task_image_seed(task_id)
-                    if result.get("code") == 1:
-                        e_context["reply"] = Reply(ReplyType.TEXT, '✅ 获取任务图片seed成功\n📨 任务ID: %s\n🔖 seed值: %s' % (
-                                        task_id, result.get("result")))
-                    else:
-                        e_context["reply"] = Reply(ReplyType.TEXT, '❌ 获取任务图片seed失败\n📨 任务ID: %s\nℹ️ %s' % (
-                                        task_id, result.get("description")))
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                elif e_context["context"].type == ContextType.IMAGE:
-                    cmd = self.cmd_dict.get(msg.actual_user_id)
-                    if not cmd:
-                        return
-                    msg.prepare()
-                    self.cmd_dict.pop(msg.actual_user_id)
-                    if "/describe" == cmd:
-                        result = self.handle_describe(content, state)
-                    elif cmd.startswith("/img2img "):
-                        result = self.handle_img2img(content, cmd[9:], state)
-                    else:
-                        return
-                else:
-                    return
+                return route.handler(e_context, route.args)
+            except CircuitOpenError as e:
+                logger.warning(f"[MJ] {e}")
+                REJECTIONS.inc("degraded")
+                e_context["reply"] = Reply(ReplyType.TEXT, DEGRADED_TEXT)
+                e_context.action = EventAction.BREAK_PASS
             except Exception as e:
                 logger.exception("[MJ] handle failed: %s" % e)
-                result = {'code': -9, 'description': '服务异常, 请稍后再试'}
-            code = result.get("code")
-            # 获取用户当前剩余次数
-            remaining_uses = self.user_datas[self.userInfo['user_id']]["mj_data"]["limit"]
-            if code == 1:
-                task_id = result.get("result")
-                self.add_task(task_id)
-
-                e_context["reply"] = Reply(ReplyType.TEXT,
-                                        f'✅ 您的任务已提交\n🚀 正在快速处理中，请稍后\n📨 任务ID: {task_id} \n⏳本次生成图像后，今日还剩余 {remaining_uses - 1} 次。')
-            elif code == 22:
-                self.add_task(result.get("result"))
-                e_context["reply"] = Reply(ReplyType.TEXT, f'✅ 您的任务已提交\n⏰ {result.get("description")} \n⏳本次生成图像后，今日还剩余 {remaining_uses - 1} 次。')
-            else:
-                e_context["reply"] = Reply(ReplyType.TEXT, f'❌ 您的任务提交失败\nℹ️ {result.get("description")} \n⏳本次生成图像后，今日还剩余 {remaining_uses} 次。')
-            e_context.action = EventAction.BREAK_PASS
+                e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 服务异常, 请稍后再试')
+                e_context.action = EventAction.BREAK_PASS
         except Exception as e:
             logger.warning(f"[MJ] failed to generate pic, error={e}")
             logger.warning(f"Traceback: {traceback.format_exc()}")
@@ -412,106 +376,574 @@ class Midjourney(Plugin):
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
 
+    def is_blocked(self, user_info) -> bool:
+        # 拦截非白名单黑名单群组
+        if not user_info["isadmin"] and user_info["isgroup"] and not user_info["iswgroup"] and user_info["isbgroup"]:
+            logger.debug("[MJ] Blocked by group whitelist/blacklist.")
+            return True
+
+        # 拦截黑名单用户
+        if not user_info["isadmin"] and user_info["isbuser"]:
+            logger.debug("[MJ] Blocked by user blacklist.")
+            return True
+        return False
+
+    def check_running(self, e_context: EventContext) -> bool:
+        # 判断是否在运行中
+        if not self.ismj:
+            e_context["reply"] = Reply(ReplyType.TEXT, 'MJ功能已停止，请联系管理员开启。')
+            e_context.action = EventAction.BREAK_PASS
+            return False
+        return True
+
+    def check_user(self, e_context: EventContext) -> bool:
+        if not self.check_running(e_context):
+            return False
+        #用户资格判断
+        with self.tracer.span("env_detection", user_id=e_context["mj_user"]["user_id"]):
+            return env_detection(self, e_context)
+
+    def get_state(self, e_context: EventContext):
+        msg: ChatMessage = e_context["context"]["msg"]
+        if not e_context["context"]["isgroup"]:
+            return "u:" + msg.other_user_id + ":" + msg.other_user_nickname
+        return "r:" + msg.other_user_id + ":" + msg.actual_user_nickname
+
+    def on_imagine(self, e_context: EventContext, prompt):
+        if not self.check_user(e_context):
+            return
+        state = self.get_state(e_context)
+        self.enqueue_submit(e_context, lambda account: self.handle_imagine(prompt, state, account), state, 'IMAGINE',
+                            dedup_key=("imagine", normalize(prompt)))
+
+    def on_up(self, e_context: EventContext, args):
+        if not self.check_user(e_context):
+            return
+        arr = args.split()
+        try:
+            task_id = arr[0]
+            index = int(arr[1])
+        except Exception as e:
+            e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 参数错误')
+            e_context.action = EventAction.BREAK_PASS
+            return
+        state = self.get_state(e_context)
+        self.enqueue_submit(e_context, lambda account: self.handle_action(task_id, index, state, account), state, None,
+                            dedup_key=("up", task_id, index), owner_task=task_id)
 
-    def handle_imagine(self, prompt, state):
-        return self.post_json('/submit/imagine', {'prompt': prompt, 'state': state})
+    def on_img2img(self, e_context: EventContext, prompt):
+        if not self.check_user(e_context):
+            return
+        with self.cmd_lock:
+            self.cmd_dict[e_context["context"]["msg"].actual_user_id] = e_context["context"].content
+        e_context["reply"] = Reply(ReplyType.TEXT, '请给我发一张图片作为垫图')
+        e_context.action = EventAction.BREAK_PASS
 
-    def handle_describe(self, img_data, state):
-        base64_str = self.image_file_to_base64(img_data)
-        return self.post_json('/submit/describe', {'base64': base64_str, 'state': state})
+    def on_describe(self, e_context: EventContext, args):
+        if not self.check_user(e_context):
+            return
+        with self.cmd_lock:
+            self.cmd_dict[e_context["context"]["msg"].actual_user_id] = e_context["context"].content
+        e_context["reply"] = Reply(ReplyType.TEXT, '请给我发一张图片用于图生文')
+        e_context.action = EventAction.BREAK_PASS
+
+    def on_shorten(self, e_context: EventContext, prompt):
+        if not self.check_user(e_context):
+            return
+        state = self.get_state(e_context)
+        # 相同提示词已分析过时直接回复缓存结果
+        cached = self.result_cache.get(("shorten", normalize(prompt))) if self.result_cache else None
+        if cached:
+            e_context["reply"] = Reply(ReplyType.TEXT, self.prompt_result_text(cached))
+            e_context.action = EventAction.BREAK_PASS
+            return
+        self.enqueue_submit(e_context, lambda account: self.handle_shorten(prompt, state, account), state, 'SHORTEN',
+                            dedup_key=("shorten", normalize(prompt)))
+
+    def on_seed(self, e_context: EventContext, task_id):
+        if not self.check_user(e_context):
+            return
+        seed = self.task_cache.get_seed(task_id)
+        if seed is not None:
+            result = {'code': 1, 'result': seed}
+        else:
+            result = self.get_task_image_seed(task_id) or {'code': -1, 'description': '任务ID不存在'}
+            if result.get("code") == 1:
+                self.task_cache.set_seed(task_id, result.get("result"))
+        if result.get("code") == 1:
+            e_context["reply"] = Reply(ReplyType.TEXT, '✅ 获取任务图片seed成功\n📨 任务ID: %s\n🔖 seed值: %s' % (
+                            task_id, result.get("result")))
+        else:
+            e_context["reply"] = Reply(ReplyType.TEXT, '❌ 获取任务图片seed失败\n📨 任务ID: %s\nℹ️ %s' % (
+                            task_id, result.get("description")))
+        e_context.action = EventAction.BREAK_PASS
+
+    def on_split(self, e_context: EventContext, args):
+        # 本地切分宫格图，不调用代理的动作接口，也不消耗次数，所以不检查剩余次数
+        if not self.check_running(e_context) or self.is_blocked(e_context["mj_user"]):
+            return
+        arr = args.split()
+        try:
+            task_id = arr[0]
+            index = int(arr[1]) if len(arr) > 1 else 0
+            if index < 0 or index > 4:
+                raise ValueError(index)
+        except Exception as e:
+            e_context["reply"] = Reply(ReplyType.TEXT, '❌ 切图失败\nℹ️ 参数错误，序号为 1-4，不填则发送全部')
+            e_context.action = EventAction.BREAK_PASS
+            return
+        state = self.get_state(e_context)
+        user_id = e_context["mj_user"]['user_id']
+        if self.submit_queue.submit(self.run_split, task_id, index, state, user_id, fair_key=self.fair_key(state)):
+            e_context["reply"] = Reply(ReplyType.TEXT, '✂️ 正在切分宫格图，请稍后\n📨 任务ID: %s' % task_id)
+        else:
+            e_context["reply"] = Reply(ReplyType.TEXT, '❌ 切图失败\nℹ️ 当前排队任务过多，请稍后再试')
+        e_context.action = EventAction.BREAK_PASS
+
+    def run_split(self, task_id, index, state, user_id):
+        context, reply_prefix = self.state_context(state)
+        try:
+            task = self.lookup_task(task_id)
+        except CircuitOpenError as e:
+            logger.warning(f"[MJ] {e}")
+            REJECTIONS.inc("degraded")
+            return self.deliver(Reply(ReplyType.TEXT, reply_prefix + DEGRADED_TEXT), context, task_id, user_id)
+        except Exception as e:
+            logger.warning(f"[MJ] fetch task {task_id} failed: {e}")
+            task = None
+        if not task or task.get('status') != 'SUCCESS' or not task.get('imageUrl'):
+            return self.deliver(Reply(ReplyType.TEXT, reply_prefix + '❌ 切图失败\nℹ️ 任务不存在或未完成'), context, task_id, user_id)
+        if task.get('action') in ('UPSCALE', 'DESCRIBE', 'SHORTEN'):
+            return self.deliver(Reply(ReplyType.TEXT, reply_prefix + '❌ 切图失败\nℹ️ 该任务结果不是宫格图'), context, task_id, user_id)
+        img_url = task['imageUrl']
+        _, img_data = self.fetch_original(img_url, task_id=task_id, user_id=user_id)
+        if img_data is None:
+            return self.deliver(Reply(ReplyType.TEXT, reply_prefix + '❌ 切图失败\nℹ️ 图片下载失败'), context, task_id, user_id)
+        max_side = self.config.get("split_tile_max_side")
+        with self.tracer.span("image_split", task_id=task_id, user_id=user_id):
+            tiles = split_grid(img_data, (max_side, max_side))
+        for i, tile in enumerate(tiles, 1):
+            if index in (0, i):
+                self.deliver(Reply(ReplyType.IMAGE, tile), context, task_id, user_id)
+        self.deliver(Reply(ReplyType.TEXT, reply_prefix + '✅ 切图完成\n📨 任务ID: %s\n💡 需要高清大图请使用 /up %s 序号' % (
+            task_id, task_id)), context, task_id, user_id)
+
+    def on_image(self, e_context: EventContext, args):
+        # 处理 /img2img 和 /describe 之后发送的图片
+        context = e_context["context"]
+        msg: ChatMessage = context["msg"]
+        # 同一用户连发多张图片时只有一张能取到待处理的指令
+        with self.cmd_lock:
+            cmd = self.cmd_dict.get(msg.actual_user_id)
+            if not cmd:
+                return
+            self.cmd_dict.pop(msg.actual_user_id)
+        state = self.get_state(e_context)
+        content = context.content
+        # 图片下载放到工作线程中进行
+        if "/describe" == cmd:
+            self.enqueue_submit(e_context, lambda account: self.handle_describe(content, state, account), state, 'DESCRIBE', msg.prepare)
+        elif cmd.startswith("/img2img "):
+            self.enqueue_submit(e_context, lambda account: self.handle_img2img(content, cmd[9:], state, account), state, 'IMAGINE', msg.prepare)
+
+    def enqueue_submit(self, e_context: EventContext, submit, state, task_action, prepare=None, dedup_key=None, owner_task=None):
+        # 获取用户当前剩余次数
+        user_info = e_context["mj_user"]
+        user_id = user_info['user_id']
+        with self.user_lock:
+            remaining_uses = self.user_datas[user_id]["mj_data"]["limit"]
+        e_context.action = EventAction.BREAK_PASS
+        # 代理熔断期间直接回复，不再排队等待超时；/up 只看原任务所属账号
+        owner = self.proxy_pool.owner(owner_task) if owner_task else None
+        if not self.proxy_pool.available(owner):
+            REJECTIONS.inc("degraded")
+            e_context["reply"] = Reply(ReplyType.TEXT, DEGRADED_TEXT)
+            return
+        # 同一用户在同一会话中重复提交相同指令时，关联到已有任务
+        if dedup_key and self.coalescer:
+            dedup_key = (user_id, state) + dedup_key
+            entry = self.coalescer.claim(dedup_key)
+            if entry is not None:
+                if entry["task_id"]:
+                    text = f'♻️ 相同的任务已提交，无需重复发送\n📨 任务ID: {entry["task_id"]}\n⏳ 完成后将直接通知您'
+                else:
+                    text = '♻️ 相同的任务已在队列中，无需重复发送\n📨 提交成功后将发送任务ID'
+                REJECTIONS.inc("duplicate")
+                e_context["reply"] = Reply(ReplyType.TEXT, text)
+                return
+        else:
+            dedup_key = None
+        # 按用户和群组限流，超出时立即拒绝并提示等待时间
+        if self.rate_limiter and not user_info['isadmin']:
+            ok, wait = self.rate_limiter.acquire(user_id, user_info['group_id'])
+            if not ok:
+                self.release_dedup(dedup_key)
+                REJECTIONS.inc("rate_limited")
+                if math.isinf(wait):
+                    # 补充速率配置为 0 时令牌用完后不再补充
+                    text = '❌ 您的任务提交失败\nℹ️ 提交次数已达上限，请联系管理员'
+                else:
+                    text = f'❌ 您的任务提交失败\nℹ️ 提交过于频繁，请 {math.ceil(wait)} 秒后再试'
+                e_context["reply"] = Reply(ReplyType.TEXT, text)
+                return
+        # 提交放入队列，由工作线程调用代理并回复任务ID，各群组之间轮流处理
+        key = self.fair_key(state)
+        ahead = self.submit_queue.ahead(key)
+        if self.submit_queue.submit(self.run_submit, submit, state, user_id, task_action, remaining_uses, prepare, dedup_key,
+                                    owner_task, fair_key=key):
+            e_context["reply"] = Reply(ReplyType.TEXT, f'⏳ 您的任务已进入队列，前方还有 {ahead} 个任务\n📨 提交成功后将发送任务ID')
+        else:
+            self.release_dedup(dedup_key)
+            REJECTIONS.inc("queue_full")
+            e_context["reply"] = Reply(ReplyType.TEXT, '❌ 您的任务提交失败\nℹ️ 当前排队任务过多，请稍后再试')
+
+    def release_dedup(self, dedup_key):
+        if dedup_key:
+            self.coalescer.release(dedup_key)
 
-    def handle_shorten(self, prompt, state):
-        return self.post_json('/submit/shorten', {'prompt': prompt, 'state': state})
 
-    def handle_img2img(self, img_data, prompt, state):
+    def handle_imagine(self, prompt, state, account=None):
+        return self.post_json('/submit/imagine', {'prompt': prompt, 'state': state}, account)
+
+    def handle_describe(self, img_data, state, account=None):
+        key = None
+        if self.result_cache:
+            # 同一张图（按感知哈希）已描述过时直接使用缓存结果
+            try:
+                with open(img_data, "rb") as image_file:
+                    key = ("describe", image_dhash(image_file.read()))
+            except Exception as e:
+                logger.warning(f"[MJ] image hash failed: {e}")
+            cached = self.result_cache.get(key) if key else None
+            if cached:
+                os.remove(img_data)
+                return {'code': 1, 'result': cached['id'], 'cached': cached}
         base64_str = self.image_file_to_base64(img_data)
-        return self.post_json('/submit/imagine', {'prompt': prompt, 'base64': base64_str, 'state': state})
+        result = self.post_json('/submit/describe', {'base64': base64_str, 'state': state}, account)
+        self.expect_result(result, key)
+        return result
 
-    def post_json(self, api_path, data):
-        return requests.post(url=self.proxy_server + api_path, json=data,
-                             headers={'mj-api-secret': self.proxy_api_secret}).json()
+    def handle_shorten(self, prompt, state, account=None):
+        result = self.post_json('/submit/shorten', {'prompt': prompt, 'state': state}, account)
+        if self.result_cache:
+            self.expect_result(result, ("shorten", normalize(prompt)))
+        return result
+
+    def expect_result(self, result, key):
+        if key and result and result.get("code") in (1, 22):
+            self.result_cache.expect(result.get("result"), key)
+
+    def handle_img2img(self, img_data, prompt, state, account=None):
+        base64_str = self.image_file_to_base64(img_data)
+        return self.post_json('/submit/imagine', {'prompt': prompt, 'base64': base64_str, 'state': state}, account)
+
+    def handle_action(self, task_id, index, state, account=None):
+        # 获取任务
+        task = self.lookup_task(task_id)
+        if task is None:
+            return {'code': -1, 'description': '任务ID不存在'}
+        if index > len(task['buttons']):
+            return {'code': -1, 'description': '按钮序号不正确'}
+        # 获取按钮
+        button = task['buttons'][index - 1]
+        if button['label'] == 'Custom Zoom':
+            return {'code': -1, 'description': '暂不支持自定义变焦'}
+        result = self.post_json('/submit/action',
+                                {'customId': button['customId'], 'taskId': task_id, 'state': state}, account)
+        if result and result.get("code") == 21:
+            result = self.post_json('/submit/modal',
+                                {'taskId': result.get("result"), 'state': state}, account)
+        return result
+
+    def run_submit(self, submit, state, user_id, task_action, remaining_uses, prepare=None, dedup_key=None, owner_task=None):
+        # 在工作线程中执行提交，并将结果发送给用户
+        context, reply_prefix = self.state_context(state)
+        account = None
+        try:
+            if prepare:
+                prepare()
+            # 新任务分给最空闲的账号，/up 等动作必须发往原任务所属的账号
+            account = self.proxy_pool.acquire(self.task_owner(owner_task) if owner_task else None)
+            with self.tracer.span("proxy_submit", user_id=user_id):
+                result = submit(account)
+        except CircuitOpenError as e:
+            logger.warning(f"[MJ] {e}")
+            result = {'code': -9, 'description': '绘图服务暂时不可用，请稍后再试'}
+        except Exception as e:
+            logger.exception("[MJ] handle failed: %s" % e)
+            result = {'code': -9, 'description': '服务异常, 请稍后再试'}
+        if not isinstance(result, dict):
+            logger.warning(f"[MJ] unexpected submit response: {result!r}")
+            result = {'code': -9, 'description': '服务异常, 请稍后再试'}
+        if result.get("code") not in (1, 22) or result.get("cached"):
+            self.proxy_pool.release(account)
+        SUBMISSIONS.inc(task_action or "ACTION", "cached" if result.get("cached") else str(result.get("code")))
+        if result.get("cached"):
+            # 命中结果缓存，不产生新任务
+            self.release_dedup(dedup_key)
+            text = self.prompt_result_text(result["cached"])
+            return self.deliver(Reply(ReplyType.TEXT, reply_prefix + text), context, result.get("result"), user_id)
+        code = result.get("code")
+        if dedup_key:
+            if code in (1, 22):
+                self.coalescer.resolve(dedup_key, result.get("result"))
+            else:
+                self.release_dedup(dedup_key)
+        if code == 1:
+            task_id = result.get("result")
+            self.add_task(task_id, 'NOT_START', state, user_id, task_action, account)
+            text = f'✅ 您的任务已提交\n🚀 正在快速处理中，请稍后\n📨 任务ID: {task_id} \n⏳本次生成图像后，今日还剩余 {remaining_uses - 1} 次。'
+        elif code == 22:
+            self.add_task(result.get("result"), 'SUBMITTED', state, user_id, task_action, account)
+            text = f'✅ 您的任务已提交\n⏰ {result.get("description")} \n⏳本次生成图像后，今日还剩余 {remaining_uses - 1} 次。'
+        else:
+            text = f'❌ 您的任务提交失败\nℹ️ {result.get("description")} \n⏳本次生成图像后，今日还剩余 {remaining_uses} 次。'
+        self.deliver(Reply(ReplyType.TEXT, reply_prefix + text), context, result.get("result"), user_id)
+
+    def fair_key(self, state):
+        # 群聊按群ID、私聊按用户ID轮流调度
+        return state.split(':', 2)[1] if ':' in state else state
+
+    def state_context(self, state):
+        # 根据 state 还原接收者，群聊回复需要 @ 用户
+        state_array = state.split(':', 2)
+        if len(state_array) < 3:
+            return None, ''
+        context = Context()
+        context.__setitem__("receiver", state_array[1])
+        reply_prefix = '@%s ' % state_array[2] if state_array[0] == 'r' else ''
+        return context, reply_prefix
+
+    def post_json(self, api_path, data, account=None):
+        if self.notify_hook_url and api_path.startswith('/submit/'):
+            data = {**data, 'notifyHook': self.notify_hook_url}
+        return self.proxy_pool.client(account).post_json(api_path, data)
+
+    def task_owner(self, task_id):
+        # 任务所属账号，本地没有记录时逐个账号查询
+        return self.proxy_pool.owner(task_id) or self.proxy_pool.find_owner(task_id)[0]
 
     def get_task(self, task_id):
-        return requests.get(url=self.proxy_server + '/task/%s/fetch' % task_id,
-                            headers={'mj-api-secret': self.proxy_api_secret}).json()
+        return self.proxy_pool.find_owner(task_id)[1]
     
+    def lookup_task(self, task_id):
+        # 已完成的任务直接读本地缓存，未命中时再查询代理
+        task = self.task_cache.get(task_id)
+        if task and task.get('status') == 'SUCCESS':
+            return task
+        task = self.get_task(task_id)
+        self.task_cache.put(task)
+        return task
+
     def get_task_image_seed(self, task_id):
-        return requests.get(url=self.proxy_server + '/task/%s/image-seed' % task_id,
-                        headers={'mj-api-secret': self.proxy_api_secret}).json()
+        client = self.proxy_pool.client(self.task_owner(task_id))
+        return client.get_json('/task/%s/image-seed' % task_id, endpoint='/task/{id}/image-seed')
+
+    def add_task(self, task_id, status='NOT_START', state=None, user_id=None, task_action=None, account=None):
+        self.proxy_pool.assign(task_id, account)
+        self.task_poller.add(task_id, status, state, user_id, task_action, account)
+
+    def on_task_expire(self, task_id, info):
+        # 超时未完成的任务释放账号槽位
+        logger.warning(f"[MJ] task {task_id} expired on account {info.get('account')}")
+        self.proxy_pool.release(info.get("account"))
+
+    def poll_loop(self):
+        # 轮询间隔由 TaskPoller 按任务自适应调整，poll_tick 为两轮查询之间的最短间隔
+        while not self.poll_stop.is_set():
+            try:
+                self.query_task_result()
+            except Exception as e:
+                logger.exception(f"[MJ] poll tasks failed: {e}")
+            self.task_poller.wait_due(self.config["poll_tick"], POLL_IDLE_SECONDS)
 
-    def add_task(self, task_id):
-        self.task_id_dict[task_id] = 'NOT_START'
+    def stop_polling(self):
+        self.poll_stop.set()
+        self.task_poller.wakeup()
 
     def query_task_result(self):
-        task_ids = list(self.task_id_dict.keys())
+        task_ids = self.task_poller.pop_due()
         if len(task_ids) == 0:
             return
-        logger.info("[MJ] handle task , size [%s]", len(task_ids))
-        tasks = self.post_json('/task/list-by-condition', {'ids': task_ids})
-        for task in tasks:
-            task_id = task['id']
-            description = task['description']
-            status = task['status']
-            action = task['action']
-            state_array = task['state'].split(':', 2)
-            
-            userInfo = self.userInfo  # 使用已获取的 userInfo
-
-            # Check length of state_array
-            if len(state_array) >= 3:
-                context = Context()
-                context.__setitem__("receiver", state_array[1])
-                reply_prefix = '@%s ' % state_array[2] if state_array[0] == 'r' else ''
-            else:
-                logger.error(f"Invalid state format: {task['state']}")
-                continue  # Skip this task or handle the error appropriately
-
-            if status == 'SUCCESS':
-                logger.debug("[MJ] 任务已完成: " + task_id)
-                self.task_id_dict.pop(task_id)
-                if action == 'DESCRIBE' or action == 'SHORTEN':
-                    prompt = task['properties']['finalPrompt']
-                    reply = Reply(ReplyType.TEXT, (
-                                reply_prefix + '✅ 任务已完成\n📨 任务ID: %s\n%s\n\n' + self.get_buttons(
-                            task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1') % (
-                                      task_id, prompt, task_id))
-                    self.channel.send(reply, context)
-                elif action == 'UPSCALE':
-                    reply = Reply(ReplyType.TEXT,
-                                  ('✅ 任务已完成\n📨 任务ID: %s\n✨ %s\n\n' + self.get_buttons(
-                                      task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1') % (
-                                      task_id, description, task_id))
-                    url_reply = Reply(ReplyType.IMAGE_URL, task['imageUrl'])
-                    self.channel.send(url_reply, context)
-                    self.channel.send(reply, context)
-                    if self.user_datas[userInfo['user_id']]["mj_data"]["limit"] > 0:
-                        self.user_datas[userInfo['user_id']]["mj_data"]["limit"] -= 1
-                        write_pickle(self.user_datas_path, self.user_datas)
-                else:
-                    reply = Reply(ReplyType.TEXT,
-                                  ('✅ 任务已完成\n📨 任务ID: %s\n✨ %s\n\n' + self.get_buttons(
-                                      task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1') % (
-                                      task_id, description, task_id))
-                    image_storage = self.download_and_compress_image(task['imageUrl'])
-                    url_reply = Reply(ReplyType.IMAGE, image_storage)
-                    self.channel.send(url_reply, context)
-                    self.channel.send(reply, context)
-                    if self.user_datas[userInfo['user_id']]["mj_data"]["limit"] > 0:
-                        self.user_datas[userInfo['user_id']]["mj_data"]["limit"] -= 1
-                        write_pickle(self.user_datas_path, self.user_datas)
-            elif status == 'FAILURE':
-                self.task_id_dict.pop(task_id)
-                reply = Reply(ReplyType.TEXT,
-                              reply_prefix + '❌ 任务执行失败\n✨ %s\n📨 任务ID: %s\n📒 失败原因: %s' % (
-                              description, task_id, task['failReason']))
-                self.channel.send(reply, context)
+        with POLL_CYCLE.time():
+            self.poll_tasks(task_ids)
+
+    def poll_tasks(self, task_ids):
+        logger.info("[MJ] handle task , size [%s/%s]", len(task_ids), len(self.task_poller))
+        # 按所属账号分组后分块并发查询，单个块失败不影响其他块，失败的任务会在下个间隔重新查询
+        by_account = {}
+        for task_id in task_ids:
+            info = self.task_poller.tasks.get(task_id) or {}
+            by_account.setdefault(info.get("account"), []).append(task_id)
+        # 熔断中的账号暂停轮询，任务留在队列中，恢复后继续查询
+        for account in [a for a in by_account if not self.proxy_pool.available(a)]:
+            logger.debug(f"[MJ] skip polling {len(by_account.pop(account))} tasks on unavailable account {account}")
+        if not by_account:
+            return
+        chunk_size = self.config["poll_chunk_size"]
+        chunks = [(account, ids[i:i + chunk_size])
+                  for account, ids in by_account.items() for i in range(0, len(ids), chunk_size)]
+        results = list(self.poll_executor.map(self.fetch_task_chunk, chunks))
+        logger.info("[MJ] list-by-condition chunks [%s], latency %s", len(chunks),
+                    [f"{account}:{len(ids)}:{cost:.3f}s" for (account, ids), (_, cost) in zip(chunks, results)])
+        for chunk_tasks, _ in results:
+            for task in chunk_tasks:
+                # 单个异常任务不影响同一轮的其他任务
+                try:
+                    self.handle_task_update(task)
+                except Exception as e:
+                    task_id = task.get('id') if isinstance(task, dict) else None
+                    logger.exception(f"[MJ] handle task {task_id} update failed: {e}")
+
+    def fetch_task_chunk(self, chunk):
+        account, task_ids = chunk
+        start = time.time()
+        try:
+            with self.tracer.span("poll", task_id=",".join(task_ids)):
+                tasks = self.post_json('/task/list-by-condition', {'ids': task_ids}, account)
+        except Exception as e:
+            logger.warning(f"[MJ] list-by-condition failed, size [{len(task_ids)}]: {e}")
+            tasks = []
+        if not isinstance(tasks, list):
+            # 4xx 错误体等非列表响应按查询失败处理，任务在下个间隔重新查询
+            logger.warning(f"[MJ] list-by-condition unexpected response, size [{len(task_ids)}]: {tasks!r:.200}")
+            tasks = []
+        return tasks, time.time() - start
+
+    def handle_task_update(self, task):
+        # 轮询结果和 notifyHook 回调共用，这里只处理状态变化，结果的下载、压缩和发送交给完成流水线
+        task_id = task['id']
+        status = task['status']
+
+        if status not in ('SUCCESS', 'FAILURE'):
+            # 未完成的任务按最新状态和进度重新安排下次查询
+            self.task_poller.update(task)
+            return
+        # 任务可能同时被轮询和回调通知，只处理一次
+        info = self.task_poller.remove(task_id)
+        if info is None:
+            return
+        self.proxy_pool.release(info.get("account"))
+        if self.coalescer:
+            self.coalescer.finish(task_id)
+        if status == 'SUCCESS':
+            logger.debug("[MJ] 任务已完成: " + task_id)
+            self.task_cache.put(task)
+            if self.result_cache and task['action'] in ('DESCRIBE', 'SHORTEN'):
+                self.result_cache.complete(task)
+        elif self.result_cache:
+            self.result_cache.discard(task_id)
+        # 接收者取自提交时保存的任务记录，不使用代理返回或回调中的 state
+        context, reply_prefix = self.state_context(info.get("state") or "")
+        if context is None:
+            logger.error(f"Invalid state format: {info.get('state')}")
+            return
+        needs_image = (status == 'SUCCESS' and task['action'] not in ('DESCRIBE', 'SHORTEN', 'UPSCALE')
+                       and bool(task.get('imageUrl')))
+        self.pipeline.submit(Completion(task, info, context, reply_prefix, needs_image))
+
+    def fetch_result_image(self, completion):
+        # 流水线的下载阶段，本地缓存中已有压缩图时直接发送，返回 False 跳过压缩
+        task, user_id = completion.task, completion.info["user_id"]
+        if self.image_cache:
+            completion.digest, rendition = self.image_cache.get_url(task['imageUrl'], RESULT_IMAGE_VERSION)
+            if rendition is not None:
+                logger.debug(f"[MJ] image cache hit: {task['imageUrl']}")
+                completion.image = io.BytesIO(rendition)
+                return False
+        # 压缩图的查找已计入命中统计，再查原图时不重复计数
+        completion.digest, completion.original = self.fetch_original(task['imageUrl'], task['id'], user_id,
+                                                                     completion.digest, count=False)
+        return completion.original is not None
+
+    def process_result_image(self, completion):
+        # 流水线的压缩阶段
+        completion.image = self.compress_image(completion.original, completion.digest, RESULT_IMAGE_SIZE,
+                                               completion.task['id'], completion.info["user_id"])
+        completion.original = None
+        return True
+
+    def deliver_completion(self, completion):
+        # 流水线的发送阶段，在接收者对应的发送线程中执行，图片和文字按顺序发出后再扣减次数
+        task, info, context, reply_prefix = completion.task, completion.info, completion.context, completion.reply_prefix
+        task_id = task['id']
+        user_id = info["user_id"]
+        description = task['description']
+        status = task['status']
+        action = task['action']
+
+        if status == 'FAILURE':
+            reply = Reply(ReplyType.TEXT,
+                          reply_prefix + '❌ 任务执行失败\n✨ %s\n📨 任务ID: %s\n📒 失败原因: %s' % (
+                          description, task_id, task['failReason']))
+            self.send_reply(reply, context, task_id, user_id)
+        elif action == 'DESCRIBE' or action == 'SHORTEN':
+            reply = Reply(ReplyType.TEXT, reply_prefix + self.prompt_result_text(task))
+            self.send_reply(reply, context, task_id, user_id)
+        elif action == 'UPSCALE':
+            reply = Reply(ReplyType.TEXT,
+                          ('✅ 任务已完成\n📨 任务ID: %s\n✨ %s\n\n' + self.get_buttons(
+                              task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1') % (
+                              task_id, description, task_id))
+            url_reply = Reply(ReplyType.IMAGE_URL, task['imageUrl'])
+            self.send_reply(url_reply, context, task_id, user_id)
+            self.send_reply(reply, context, task_id, user_id)
+            self.consume_limit(user_id)
+        else:
+            reply = Reply(ReplyType.TEXT,
+                          ('✅ 任务已完成\n📨 任务ID: %s\n✨ %s\n\n' + self.get_buttons(
+                              task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1\n'
+                           + '👀 使用 /split 任务ID 序号本地预览单张\n🔖 /split %s 1') % (
+                              task_id, description, task_id, task_id))
+            # 图片下载失败时只发送文字结果
+            if completion.image is not None:
+                self.send_reply(Reply(ReplyType.IMAGE, completion.image), context, task_id, user_id)
+            self.send_reply(reply, context, task_id, user_id)
+            self.consume_limit(user_id)
+        TASK_LATENCY.observe(time.time() - info["submit_time"], action, status)
+
+    def deliver(self, reply, context, task_id=None, user_id=None):
+        # 交给发送线程，与同一接收者的其他消息保持顺序
+        self.pipeline.send(context.get("receiver"), self.send_reply, reply, context, task_id, user_id)
+
+    def send_reply(self, reply, context, task_id=None, user_id=None):
+        with self.tracer.span("channel_send", task_id=task_id, user_id=user_id):
+            self.channel.send(reply, context)
+
+    def consume_limit(self, user_id):
+        # 任务完成后扣减提交者的剩余次数，user_id 取自任务记录而不是当前消息
+        with self.user_lock:
+            mj_data = self.user_datas.get(user_id, {}).get("mj_data")
+            if mj_data and mj_data["limit"] > 0:
+                mj_data["limit"] -= 1
+                self.user_store.save_user(user_id, self.user_datas[user_id])
 
     def image_file_to_base64(self, file_path):
         with open(file_path, "rb") as image_file:
             img_data = image_file.read()
-        img_base64 = base64.b64encode(img_data).decode("utf-8")
         os.remove(file_path)
-        return "data:image/png;base64," + img_base64
+        mime = None
+        if self.config.get("upload_preprocess_enabled"):
+            # 缩小并重新编码参考图，减少上传体积
+            try:
+                with self.tracer.span("image_prepare"):
+                    size = len(img_data)
+                    img_data, mime = prepare_upload(img_data, self.config.get("upload_max_side"),
+                                                    self.config.get("upload_format"), self.config.get("upload_quality"))
+                logger.debug(f"[MJ] upload image {size} -> {len(img_data)} bytes, {mime}")
+            except Exception as e:
+                logger.warning(f"[MJ] prepare upload image failed, send original: {e}")
+        if mime is None:
+            mime = guess_mime(img_data)
+        img_base64 = base64.b64encode(img_data).decode("utf-8")
+        return f"data:{mime};base64," + img_base64
+
+    def prompt_result_text(self, task):
+        # /describe 和 /shorten 的结果文本，缓存命中时复用原任务的按钮
+        task_id = task['id']
+        return ('✅ 任务已完成\n📨 任务ID: %s\n%s\n\n' + self.get_buttons(
+            task) + '\n' + '💡 使用 /up 任务ID 序号执行动作\n🔖 /up %s 1') % (
+                   task_id, task['properties']['finalPrompt'], task_id)
 
     def get_buttons(self, task):
         # 定义 emoji 和 label 的字典
@@ -580,457 +1012,534 @@ class Midjourney(Plugin):
         return res
 
 
-    def download_and_compress_image(self, img_url, max_size=(800, 800)):
-        session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[ 500, 502, 503, 504 ])
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        
+    def fetch_original(self, img_url, task_id=None, user_id=None, digest=None, count=True):
+        """获取原图数据，优先读本地缓存，返回 (内容哈希, 图片数据)；count=False 时不计入缓存命中统计"""
+        cache = self.image_cache
+        if cache:
+            digest = digest or cache.lookup(img_url)
+            if digest:
+                original = cache.get(digest, count=count)
+                if original is not None:
+                    return digest, original
         try:
-            # 下载图片
-            pic_res = session.get(img_url, stream=True)
-            pic_res.raise_for_status()  # 如果返回错误码, 则抛出异常
+            with self.tracer.span("image_download", task_id=task_id, user_id=user_id):
+                image_storage = self.image_fetcher.fetch(img_url)
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to download image: {e}")
-            return None
-        
-        image_storage = io.BytesIO()
-        for block in pic_res.iter_content(1024):
-            image_storage.write(block)
-        image_storage.seek(0)
-
-        # 压缩图片
-        initial_image = Image.open(image_storage)
-        initial_image.thumbnail(max_size)
-        output = io.BytesIO()
-        initial_image.save(output, format=initial_image.format)
-        output.seek(0)
-
+            return None, None
+        original = image_storage.getvalue()
+        if cache:
+            digest = cache.put_original(img_url, original)
+        return digest, original
+
+    def compress_image(self, original, digest=None, max_size=RESULT_IMAGE_SIZE, task_id=None, user_id=None):
+        # 压缩图片，结果按原图哈希和尺寸写入本地缓存
+        with self.tracer.span("image_compress", task_id=task_id, user_id=user_id), IMAGE_COMPRESS.time():
+            initial_image = Image.open(io.BytesIO(original))
+            initial_image.thumbnail(max_size)
+            output = io.BytesIO()
+            initial_image.save(output, format=initial_image.format)
+            output.seek(0)
+
+        cache = self.image_cache
+        if cache and digest:
+            cache.put(digest, "%dx%d" % max_size, output.getvalue())
+            logger.debug(f"[MJ] image cache stats: {cache.stats()}")
         return output
 
     # 指令处理
-    def handle_command(self, e_context: EventContext):
-        content = e_context['context'].content
-        com = content[1:].strip().split()
-        cmd = com[0]
-        args = com[1:]
-        if any(cmd in info["alias"] for info in COMMANDS.values()):
-            cmd = next(c for c, info in COMMANDS.items() if cmd in info["alias"])
-            if cmd == "mj_help":
-                return Info(self.get_help_text(admin=self.userInfo.get("isadmin", False)), e_context)
-            elif cmd == "mj_admin_cmd":
-                if not self.userInfo["isadmin"]:
-                    return Error("[MJ] 您没有权限执行该操作，请先进行管理员认证", e_context)
-                return Info(self.get_help_text(admin=True), e_context)
-            elif cmd == "mj_admin_password":
-                ok, result = self.authenticate(self.userInfo, args)
-                if not ok:
-                    return Error(result, e_context)
-                else:
-                    return Info(result, e_context)
-        elif any(cmd in info["alias"] for info in ADMIN_COMMANDS.values()):
-            cmd = next(c for c, info in ADMIN_COMMANDS.items() if cmd in info["alias"])
-            if not self.userInfo["isadmin"]:
-                return Error("[MJ] 您没有权限执行该操作，请先进行管理员认证", e_context)
-            
-            # 在 handle_command 函数中添加 mj_g_info 处理逻辑
-            if cmd == "mj_g_info":
-                user_infos = []
-                for uid, data in self.user_datas.items():
-                    # 获取用户昵称和剩余次数
-                    user_nickname = data.get("mj_data", {}).get("nickname", None)
-                    limit = data.get("mj_data", {}).get("limit", "未知次数")
-                    
-                    # 如果找不到昵称，尝试使用 search_friends 函数
-                    if not user_nickname:
-                        user_info = search_friends(uid)
-                        user_nickname = user_info.get("user_nickname", None)
-
-                    # 只在找到昵称的情况下添加到结果中
-                    if user_nickname:
-                        user_infos.append(f"{user_nickname}: {limit}次")
-
-                # 将所有用户信息拼接成一个字符串
-                if user_infos:
-                    info_text = "当前用户昵称及剩余次数:\n" + "\n".join(user_infos)
-                else:
-                    info_text = "没有找到用户数据。"
-                
-                return Info(info_text, e_context)
-
-
-
-            elif cmd == "mj_s_limit":
-                if len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的数量", e_context)
-                limit = int(args[0])
-                if limit < 0:
-                    return Error("[MJ] 数量不能小于0", e_context)
-                self.config["daily_limit"] = limit
-                for index, item in self.user_datas.items():
-                    if "mj_data" in item:  # 确保 mj_data 字段存在
-                        self.user_datas[index]["mj_data"]["limit"] = limit
-                write_pickle(self.user_datas_path, self.user_datas)
-                write_file(self.json_path, self.config)
-                return Info(f"[MJ] 每日使用次数已设置为{limit}次", e_context)
-
-            elif cmd == "mj_r_limit":
-                for index, item in self.user_datas.items():
-                    if "mj_data" in item:  # 确保 mj_data 字段存在
-                        self.user_datas[index]["mj_data"]["limit"] = self.config["daily_limit"]
-                write_pickle(self.user_datas_path, self.user_datas)
-                return Info(f"[MJ] 所有用户每日使用次数已重置为{self.config['daily_limit']}次", e_context)
-
-            elif cmd == "set_mj_admin_password":
-                if len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的密码", e_context)
-                password = args[0]
-                if self.isgroup:
-                    return Error("[MJ] 为避免密码泄露，请勿在群聊中进行修改", e_context)
-                if len(password) < 6:
-                    return Error("[MJ] 密码长度不能小于6位", e_context)
-                if password == self.config['mj_admin_password']:
-                    return Error("[MJ] 新密码不能与旧密码相同", e_context)
-                self.config["mj_admin_password"] = password
-                write_file(self.json_path, self.config)
-                return Info("[MJ] 管理员口令设置成功", e_context)
-            elif cmd == "mj_stop":
-                self.ismj = False
-                return Info("[MJ] 服务已暂停", e_context)
-            elif cmd == "mj_enable":
-                self.ismj = True
-                return Info("[MJ] 服务已启用", e_context)
-            elif cmd == "mj_g_admin_list" and not self.isgroup:
-                adminUser = self.roll["mj_admin_users"]
-                t = "\n"
-                nameList = t.join(f'{index+1}. {data["user_nickname"]}' for index, data in enumerate(adminUser))
-                return Info(f"[MJ] 管理员用户\n{nameList}", e_context)
-            elif cmd == "mj_c_admin_list" and not self.isgroup:
-                self.roll["mj_admin_users"] = []
-                write_pickle(self.roll_path, self.roll)
-                return Info("[MJ] 管理员用户已清空", e_context)
-            elif cmd == "mj_s_admin_list" and not self.isgroup:
-                user_name = args[0] if args and args[0] else ""
-                adminUsers = self.roll["mj_admin_users"]
-                buser = self.roll["mj_busers"]
-                if not args or len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的管理员名称或ID", e_context)
+    def handle_command(self, e_context: EventContext, route):
+        if route.admin and not e_context["mj_user"]["isadmin"]:
+            return Error("[MJ] 您没有权限执行该操作，请先进行管理员认证", e_context)
+        return route.handler(e_context, route.args)
+
+    def cmd_mj_help(self, e_context: EventContext, args):
+        user_info = e_context["mj_user"]
+        return Info(self.get_help_text(user_info, admin=user_info.get("isadmin", False)), e_context)
+
+    def cmd_mj_admin_cmd(self, e_context: EventContext, args):
+        user_info = e_context["mj_user"]
+        if not user_info["isadmin"]:
+            return Error("[MJ] 您没有权限执行该操作，请先进行管理员认证", e_context)
+        return Info(self.get_help_text(user_info, admin=True), e_context)
+
+    def cmd_mj_admin_password(self, e_context: EventContext, args):
+        ok, result = self.authenticate(e_context["mj_user"], args)
+        if not ok:
+            return Error(result, e_context)
+        else:
+            return Info(result, e_context)
+
+    def cmd_mj_g_info(self, e_context: EventContext, args):
+        user_infos = []
+        with self.user_lock:
+            user_datas = {uid: dict(data.get("mj_data", {})) for uid, data in self.user_datas.items()}
+        for uid, mj_data in user_datas.items():
+            # 获取用户昵称和剩余次数
+            user_nickname = mj_data.get("nickname", None)
+            limit = mj_data.get("limit", "未知次数")
+
+            # 如果找不到昵称，尝试使用 search_friends 函数
+            if not user_nickname:
+                user_info = search_friends(uid)
+                user_nickname = user_info.get("user_nickname", None)
+
+            # 只在找到昵称的情况下添加到结果中
+            if user_nickname:
+                user_infos.append(f"{user_nickname}: {limit}次")
+
+        # 将所有用户信息拼接成一个字符串
+        if user_infos:
+            info_text = "当前用户昵称及剩余次数:\n" + "\n".join(user_infos)
+        else:
+            info_text = "没有找到用户数据。"
+
+        return Info(info_text, e_context)
+
+    @roll_locked
+    def cmd_mj_s_limit(self, e_context: EventContext, args):
+        if len(args) < 1:
+            return Error("[MJ] 请输入需要设置的数量", e_context)
+        limit = int(args[0])
+        if limit < 0:
+            return Error("[MJ] 数量不能小于0", e_context)
+        self.config["daily_limit"] = limit
+        with self.user_lock:
+            for index, item in self.user_datas.items():
+                if "mj_data" in item:  # 确保 mj_data 字段存在
+                    self.user_datas[index]["mj_data"]["limit"] = limit
+            self.user_store.save_users(self.user_datas)
+        write_file(self.json_path, self.config)
+        return Info(f"[MJ] 每日使用次数已设置为{limit}次", e_context)
+
+    @roll_locked
+    def cmd_mj_r_limit(self, e_context: EventContext, args):
+        with self.user_lock:
+            for index, item in self.user_datas.items():
+                if "mj_data" in item:  # 确保 mj_data 字段存在
+                    self.user_datas[index]["mj_data"]["limit"] = self.config["daily_limit"]
+            self.user_store.save_users(self.user_datas)
+        return Info(f"[MJ] 所有用户每日使用次数已重置为{self.config['daily_limit']}次", e_context)
+
+    @roll_locked
+    def cmd_set_mj_admin_password(self, e_context: EventContext, args):
+        if len(args) < 1:
+            return Error("[MJ] 请输入需要设置的密码", e_context)
+        password = args[0]
+        if e_context["mj_user"]["isgroup"]:
+            return Error("[MJ] 为避免密码泄露，请勿在群聊中进行修改", e_context)
+        if len(password) < 6:
+            return Error("[MJ] 密码长度不能小于6位", e_context)
+        if password == self.config['mj_admin_password']:
+            return Error("[MJ] 新密码不能与旧密码相同", e_context)
+        self.config["mj_admin_password"] = password
+        write_file(self.json_path, self.config)
+        return Info("[MJ] 管理员口令设置成功", e_context)
+
+    @roll_locked
+    def cmd_mj_stop(self, e_context: EventContext, args):
+        self.ismj = False
+        return Info("[MJ] 服务已暂停", e_context)
+
+    @roll_locked
+    def cmd_mj_enable(self, e_context: EventContext, args):
+        self.ismj = True
+        return Info("[MJ] 服务已启用", e_context)
+
+    def cmd_mj_g_admin_list(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        adminUser = self.roll["mj_admin_users"]
+        t = "\n"
+        nameList = t.join(f'{index+1}. {data["user_nickname"]}' for index, data in enumerate(adminUser))
+        return Info(f"[MJ] 管理员用户\n{nameList}", e_context)
+
+    @roll_locked
+    def cmd_mj_c_admin_list(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        self.roll["mj_admin_users"] = []
+        self.roll_clear("mj_admin_users")
+        return Info("[MJ] 管理员用户已清空", e_context)
+
+    @roll_locked
+    def cmd_mj_s_admin_list(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        user_name = args[0] if args and args[0] else ""
+        adminUsers = self.roll["mj_admin_users"]
+        buser = self.roll["mj_busers"]
+        if not args or len(args) < 1:
+            return Error("[MJ] 请输入需要设置的管理员名称或ID", e_context)
+        index = -1
+        for i, user in enumerate(adminUsers):
+            if user["user_id"] == user_name or user["user_nickname"] == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 管理员[{adminUsers[index]['user_nickname']}]已在列表中", e_context)
+        for i, user in enumerate(buser):
+            if user == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 用户[{user_name}]已在黑名单中，如需添加请先进行移除", e_context)
+        userInfo = {
+            "user_id": user_name,
+            "user_nickname": user_name
+        }
+        # 判断是否是itchat平台
+        if conf().get("channel_type", "wx") == "wx":
+            userInfo = search_friends(user_name)
+            # 判断user_name是否在列表中
+            if not userInfo or not userInfo["user_id"]:
+                return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
+        adminUsers.append(userInfo)
+        self.roll["mj_admin_users"] = adminUsers
+        # 写入用户列表
+        self.roll_add("mj_admin_users", userInfo)
+        return Info(f"[MJ] 管理员[{userInfo['user_nickname']}]已添加到列表中", e_context)
+
+    @roll_locked
+    def cmd_mj_r_admin_list(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        text = ""
+        adminUsers = self.roll["mj_admin_users"]
+        if len(args) < 1:
+            return Error("[MJ] 请输入需要移除的管理员名称或ID或序列号", e_context)
+        if args and args[0]:
+            if args[0].isdigit():
+                index = int(args[0]) - 1
+                if index < 0 or index >= len(adminUsers):
+                    return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
+                user_name = adminUsers[index]['user_nickname']
+                self.roll_remove("mj_admin_users", adminUsers[index])
+                del adminUsers[index]
+                self.roll["mj_admin_users"] = adminUsers
+                text = f"[MJ] 管理员[{user_name}]已从列表中移除"
+            else:
+                user_name = args[0]
                 index = -1
                 for i, user in enumerate(adminUsers):
-                    if user["user_id"] == user_name or user["user_nickname"] == user_name:
-                        index = i
-                        break
-                if index >= 0:
-                    return Error(f"[MJ] 管理员[{adminUsers[index]['user_nickname']}]已在列表中", e_context)
-                for i, user in enumerate(buser):
-                    if user == user_name:
+                    if user["user_nickname"] == user_name or user["user_id"] == user_name:
                         index = i
                         break
                 if index >= 0:
-                    return Error(f"[MJ] 用户[{user_name}]已在黑名单中，如需添加请先进行移除", e_context)
-                userInfo = {
-                    "user_id": user_name,
-                    "user_nickname": user_name
-                }
-                # 判断是否是itchat平台
-                if conf().get("channel_type", "wx") == "wx":
-                    userInfo = search_friends(user_name)
-                    # 判断user_name是否在列表中
-                    if not userInfo or not userInfo["user_id"]:
-                        return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
-                adminUsers.append(userInfo)
-                self.roll["mj_admin_users"] = adminUsers
-                # 写入用户列表
-                write_pickle(self.roll_path, self.roll)
-                return Info(f"[MJ] 管理员[{userInfo['user_nickname']}]已添加到列表中", e_context)
-            elif cmd == "mj_r_admin_list" and not self.isgroup:
-                text = ""
-                adminUsers = self.roll["mj_admin_users"]
-                if len(args) < 1:
-                    return Error("[MJ] 请输入需要移除的管理员名称或ID或序列号", e_context)
-                if args and args[0]:
-                    if args[0].isdigit():
-                        index = int(args[0]) - 1
-                        if index < 0 or index >= len(adminUsers):
-                            return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
-                        user_name = adminUsers[index]['user_nickname']
-                        del adminUsers[index]
-                        self.roll["mj_admin_users"] = adminUsers
-                        write_pickle(self.roll_path, self.roll)
-                        text = f"[MJ] 管理员[{user_name}]已从列表中移除"
-                    else:
-                        user_name = args[0]
-                        index = -1
-                        for i, user in enumerate(adminUsers):
-                            if user["user_nickname"] == user_name or user["user_id"] == user_name:
-                                index = i
-                                break
-                        if index >= 0:
-                            del adminUsers[index]
-                            text = f"[MJ] 管理员[{user_name}]已从列表中移除"
-                            self.roll["mj_admin_users"] = adminUsers
-                            write_pickle(self.roll_path, self.roll)
-                        else:
-                            return Error(f"[MJ] 管理员[{user_name}]不在列表中", e_context)
-                return Info(text, e_context)
-            elif cmd == "mj_g_wgroup" and not self.isgroup:
-                text = ""
-                groups = self.roll["mj_groups"]
-                if len(groups) == 0:
-                    text = "[MJ] 白名单群组：无"
-                else:
-                    t = "\n"
-                    nameList = t.join(f'{index+1}. {group}' for index, group in enumerate(groups))
-                    text = f"[MJ] 白名单群组\n{nameList}"
-                return Info(text, e_context)
-            elif cmd == "mj_c_wgroup":
-                self.roll["mj_groups"] = []
-                write_pickle(self.roll_path, self.roll)
-                return Info("[MJ] 群组白名单已清空", e_context)
-            elif cmd == "mj_s_wgroup":
-                groups = self.roll["mj_groups"]
-                bgroups = self.roll["mj_bgroups"]
-                if not self.isgroup and len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的群组名称", e_context)
-                if self.isgroup:
-                    group_name = self.userInfo["group_name"]
-                if args and args[0]:
-                    group_name = args[0]
-                if group_name in groups:
-                    return Error(f"[MJ] 群组[{group_name}]已在白名单中", e_context)
-                if group_name in bgroups:
-                    return Error(f"[MJ] 群组[{group_name}]已在黑名单中，如需添加请先进行移除", e_context)
-                # 判断是否是itchat平台，并判断group_name是否在列表中
-                if conf().get("channel_type", "wx") == "wx":
-                    chatrooms = itchat.search_chatrooms(name=group_name)
-                    if len(chatrooms) == 0:
-                        return Error(f"[MJ] 群组[{group_name}]不存在", e_context)
-                groups.append(group_name)
-                self.roll["mj_groups"] = groups
-                write_pickle(self.roll_path, self.roll)
-                return Info(f"[MJ] 群组[{group_name}]已添加到白名单", e_context)
-            elif cmd == "mj_r_wgroup":
-                groups = self.roll["mj_groups"]
-                if not self.isgroup and len(args) < 1:
-                    return Error("[MJ] 请输入需要移除的群组名称或序列号", e_context)
-                if self.isgroup:
-                    group_name = self.userInfo["group_name"]
-                if args and args[0]:
-                    if args[0].isdigit():
-                        index = int(args[0]) - 1
-                        if index < 0 or index >= len(groups):
-                            return Error(f"[MJ] 序列号[{args[0]}]不在白名单中", e_context)
-                        group_name = groups[index]
-                    else:
-                        group_name = args[0]
-                if group_name in groups:
-                    groups.remove(group_name)
-                    self.roll["mj_groups"] = groups
-                    write_pickle(self.roll_path, self.roll)
-                    return Info(f"[MJ] 群组[{group_name}]已从白名单中移除", e_context)
-                else:
-                    return Error(f"[MJ] 群组[{group_name}]不在白名单中", e_context)
-            elif cmd == "mj_g_bgroup" and not self.isgroup:
-                text = ""
-                bgroups = self.roll["mj_bgroups"]
-                if len(bgroups) == 0:
-                    text = "[MJ] 黑名单群组：无"
-                else:
-                    t = "\n"
-                    nameList = t.join(f'{index+1}. {group}' for index, group in enumerate(bgroups))
-                    text = f"[MJ] 黑名单群组\n{nameList}"
-                return Info(text, e_context)
-            elif cmd == "mj_c_bgroup":
-                self.roll["mj_bgroups"] = []
-                write_pickle(self.roll_path, self.roll)
-                return Info("[MJ] 已清空黑名单群组", e_context)
-            elif cmd == "mj_s_bgroup":
-                groups = self.roll["mj_groups"]
-                bgroups = self.roll["mj_bgroups"]
-                if not self.isgroup and len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的群组名称", e_context)
-                if self.isgroup:
-                    group_name = self.userInfo["group_name"]
-                if args and args[0]:
-                    group_name = args[0]
-                if group_name in groups:
-                    return Error(f"[MJ] 群组[{group_name}]已在白名单中，如需添加请先进行移除", e_context)
-                if group_name in bgroups:
-                    return Error(f"[MJ] 群组[{group_name}]已在黑名单中", e_context)
-                # 判断是否是itchat平台，并判断group_name是否在列表中
-                if conf().get("channel_type", "wx") == "wx":
-                    chatrooms = itchat.search_chatrooms(name=group_name)
-                    if len(chatrooms) == 0:
-                        return Error(f"[MJ] 群组[{group_name}]不存在", e_context)
-                bgroups.append(group_name)
-                self.roll["mj_bgroups"] = bgroups
-                write_pickle(self.roll_path, self.roll)
-                return Info(f"[MJ] 群组[{group_name}]已添加到黑名单", e_context)
-            elif cmd == "mj_r_bgroup":
-                bgroups = self.roll["mj_bgroups"]
-                if not self.isgroup and len(args) < 1:
-                    return Error("[MJ] 请输入需要移除的群组名称或序列号", e_context)
-                if self.isgroup:
-                    group_name = self.userInfo["group_name"]
-                if args and args[0]:
-                    if args[0].isdigit():
-                        index = int(args[0]) - 1
-                        if index < 0 or index >= len(bgroups):
-                            return Error(f"[MJ] 序列号[{args[0]}]不在黑名单中", e_context)
-                        group_name = bgroups[index]
-                    else:
-                        group_name = args[0]
-                if group_name in bgroups:
-                    bgroups.remove(group_name)
-                    self.roll["mj_bgroups"] = bgroups
-                    write_pickle(self.roll_path, self.roll)
-                    return Info(f"[MJ] 群组[{group_name}]已从黑名单中移除", e_context)
-                else:
-                    return Error(f"[MJ] 群组[{group_name}]不在黑名单中", e_context)
-            elif cmd == "mj_g_buser" and not self.isgroup:
-                busers = self.roll["mj_busers"]
-                if len(busers) == 0:
-                    return Info("[MJ] 黑名单用户：无", e_context)
-                else:
-                    t = "\n"
-                    nameList = t.join(f'{index+1}. {data}' for index, data in enumerate(busers))
-                    return Info(f"[MJ] 黑名单用户\n{nameList}", e_context)
-            elif cmd == "mj_g_wuser" and not self.isgroup:
-                users = self.roll["mj_users"]
-                if len(users) == 0:
-                    return Info("[MJ] 白名单用户：无", e_context)
+                    self.roll_remove("mj_admin_users", adminUsers[index])
+                    del adminUsers[index]
+                    text = f"[MJ] 管理员[{user_name}]已从列表中移除"
+                    self.roll["mj_admin_users"] = adminUsers
                 else:
-                    t = "\n"
-                    nameList = t.join(f'{index+1}. {data}' for index, data in enumerate(users))
-                    return Info(f"[MJ] 白名单用户\n{nameList}", e_context)
-            elif cmd == "mj_c_wuser":
-                self.roll["mj_users"] = []
-                write_pickle(self.roll_path, self.roll)
-                return Info("[MJ] 用户白名单已清空", e_context)
-            elif cmd == "mj_c_buser":
-                self.roll["mj_busers"] = []
-                write_pickle(self.roll_path, self.roll)
-                return Info("[MJ] 用户黑名单已清空", e_context)
-            elif cmd == "mj_s_wuser":
-                user_name = args[0] if args and args[0] else ""
-                users = self.roll["mj_users"]
-                busers = self.roll["mj_busers"]
-                if not args or len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的用户名称或ID", e_context)
-                index = -1
-                for i, user in enumerate(users):
-                    if user == user_name:
-                        index = i
-                        break
-                if index >= 0:
-                    return Error(f"[MJ] 用户[{user_name}]已在白名单中", e_context)
-                for i, user in enumerate(busers):
-                    if user == user_name:
-                        index = i
-                        break
-                if index >= 0:
-                    return Error(f"[MJ] 用户[{user_name}]已在黑名单中，如需添加请先移除黑名单", e_context)
-                # 判断是否是itchat平台
-                if conf().get("channel_type", "wx") == "wx":
-                    userInfo = search_friends(user_name)
-                    # 判断user_name是否在列表中
-                    if not userInfo or not userInfo["user_id"]:
-                        return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
-                users.append(user_name)
+                    return Error(f"[MJ] 管理员[{user_name}]不在列表中", e_context)
+        return Info(text, e_context)
+
+    def cmd_mj_g_wgroup(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        text = ""
+        groups = self.roll["mj_groups"]
+        if len(groups) == 0:
+            text = "[MJ] 白名单群组：无"
+        else:
+            t = "\n"
+            nameList = t.join(f'{index+1}. {group}' for index, group in enumerate(groups))
+            text = f"[MJ] 白名单群组\n{nameList}"
+        return Info(text, e_context)
+
+    @roll_locked
+    def cmd_mj_c_wgroup(self, e_context: EventContext, args):
+        self.roll["mj_groups"] = []
+        self.roll_clear("mj_groups")
+        return Info("[MJ] 群组白名单已清空", e_context)
+
+    @roll_locked
+    def cmd_mj_s_wgroup(self, e_context: EventContext, args):
+        groups = self.roll["mj_groups"]
+        bgroups = self.roll["mj_bgroups"]
+        if not e_context["mj_user"]["isgroup"] and len(args) < 1:
+            return Error("[MJ] 请输入需要设置的群组名称", e_context)
+        if e_context["mj_user"]["isgroup"]:
+            group_name = e_context["mj_user"]["group_name"]
+        if args and args[0]:
+            group_name = args[0]
+        if group_name in groups:
+            return Error(f"[MJ] 群组[{group_name}]已在白名单中", e_context)
+        if group_name in bgroups:
+            return Error(f"[MJ] 群组[{group_name}]已在黑名单中，如需添加请先进行移除", e_context)
+        # 判断是否是itchat平台，并判断group_name是否在列表中
+        if conf().get("channel_type", "wx") == "wx":
+            chatrooms = itchat.search_chatrooms(name=group_name)
+            if len(chatrooms) == 0:
+                return Error(f"[MJ] 群组[{group_name}]不存在", e_context)
+        groups.append(group_name)
+        self.roll["mj_groups"] = groups
+        self.roll_add("mj_groups", group_name)
+        return Info(f"[MJ] 群组[{group_name}]已添加到白名单", e_context)
+
+    @roll_locked
+    def cmd_mj_r_wgroup(self, e_context: EventContext, args):
+        groups = self.roll["mj_groups"]
+        if not e_context["mj_user"]["isgroup"] and len(args) < 1:
+            return Error("[MJ] 请输入需要移除的群组名称或序列号", e_context)
+        if e_context["mj_user"]["isgroup"]:
+            group_name = e_context["mj_user"]["group_name"]
+        if args and args[0]:
+            if args[0].isdigit():
+                index = int(args[0]) - 1
+                if index < 0 or index >= len(groups):
+                    return Error(f"[MJ] 序列号[{args[0]}]不在白名单中", e_context)
+                group_name = groups[index]
+            else:
+                group_name = args[0]
+        if group_name in groups:
+            groups.remove(group_name)
+            self.roll["mj_groups"] = groups
+            self.roll_remove("mj_groups", group_name)
+            return Info(f"[MJ] 群组[{group_name}]已从白名单中移除", e_context)
+        else:
+            return Error(f"[MJ] 群组[{group_name}]不在白名单中", e_context)
+
+    def cmd_mj_g_bgroup(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        text = ""
+        bgroups = self.roll["mj_bgroups"]
+        if len(bgroups) == 0:
+            text = "[MJ] 黑名单群组：无"
+        else:
+            t = "\n"
+            nameList = t.join(f'{index+1}. {group}' for index, group in enumerate(bgroups))
+            text = f"[MJ] 黑名单群组\n{nameList}"
+        return Info(text, e_context)
+
+    @roll_locked
+    def cmd_mj_c_bgroup(self, e_context: EventContext, args):
+        self.roll["mj_bgroups"] = []
+        self.roll_clear("mj_bgroups")
+        return Info("[MJ] 已清空黑名单群组", e_context)
+
+    @roll_locked
+    def cmd_mj_s_bgroup(self, e_context: EventContext, args):
+        groups = self.roll["mj_groups"]
+        bgroups = self.roll["mj_bgroups"]
+        if not e_context["mj_user"]["isgroup"] and len(args) < 1:
+            return Error("[MJ] 请输入需要设置的群组名称", e_context)
+        if e_context["mj_user"]["isgroup"]:
+            group_name = e_context["mj_user"]["group_name"]
+        if args and args[0]:
+            group_name = args[0]
+        if group_name in groups:
+            return Error(f"[MJ] 群组[{group_name}]已在白名单中，如需添加请先进行移除", e_context)
+        if group_name in bgroups:
+            return Error(f"[MJ] 群组[{group_name}]已在黑名单中", e_context)
+        # 判断是否是itchat平台，并判断group_name是否在列表中
+        if conf().get("channel_type", "wx") == "wx":
+            chatrooms = itchat.search_chatrooms(name=group_name)
+            if len(chatrooms) == 0:
+                return Error(f"[MJ] 群组[{group_name}]不存在", e_context)
+        bgroups.append(group_name)
+        self.roll["mj_bgroups"] = bgroups
+        self.roll_add("mj_bgroups", group_name)
+        return Info(f"[MJ] 群组[{group_name}]已添加到黑名单", e_context)
+
+    @roll_locked
+    def cmd_mj_r_bgroup(self, e_context: EventContext, args):
+        bgroups = self.roll["mj_bgroups"]
+        if not e_context["mj_user"]["isgroup"] and len(args) < 1:
+            return Error("[MJ] 请输入需要移除的群组名称或序列号", e_context)
+        if e_context["mj_user"]["isgroup"]:
+            group_name = e_context["mj_user"]["group_name"]
+        if args and args[0]:
+            if args[0].isdigit():
+                index = int(args[0]) - 1
+                if index < 0 or index >= len(bgroups):
+                    return Error(f"[MJ] 序列号[{args[0]}]不在黑名单中", e_context)
+                group_name = bgroups[index]
+            else:
+                group_name = args[0]
+        if group_name in bgroups:
+            bgroups.remove(group_name)
+            self.roll["mj_bgroups"] = bgroups
+            self.roll_remove("mj_bgroups", group_name)
+            return Info(f"[MJ] 群组[{group_name}]已从黑名单中移除", e_context)
+        else:
+            return Error(f"[MJ] 群组[{group_name}]不在黑名单中", e_context)
+
+    def cmd_mj_g_buser(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        busers = self.roll["mj_busers"]
+        if len(busers) == 0:
+            return Info("[MJ] 黑名单用户：无", e_context)
+        else:
+            t = "\n"
+            nameList = t.join(f'{index+1}. {data}' for index, data in enumerate(busers))
+            return Info(f"[MJ] 黑名单用户\n{nameList}", e_context)
+
+    def cmd_mj_g_wuser(self, e_context: EventContext, args):
+        if e_context["mj_user"]["isgroup"]:
+            return
+        users = self.roll["mj_users"]
+        if len(users) == 0:
+            return Info("[MJ] 白名单用户：无", e_context)
+        else:
+            t = "\n"
+            nameList = t.join(f'{index+1}. {data}' for index, data in enumerate(users))
+            return Info(f"[MJ] 白名单用户\n{nameList}", e_context)
+
+    @roll_locked
+    def cmd_mj_c_wuser(self, e_context: EventContext, args):
+        self.roll["mj_users"] = []
+        self.roll_clear("mj_users")
+        return Info("[MJ] 用户白名单已清空", e_context)
+
+    @roll_locked
+    def cmd_mj_c_buser(self, e_context: EventContext, args):
+        self.roll["mj_busers"] = []
+        self.roll_clear("mj_busers")
+        return Info("[MJ] 用户黑名单已清空", e_context)
+
+    @roll_locked
+    def cmd_mj_s_wuser(self, e_context: EventContext, args):
+        user_name = args[0] if args and args[0] else ""
+        users = self.roll["mj_users"]
+        busers = self.roll["mj_busers"]
+        if not args or len(args) < 1:
+            return Error("[MJ] 请输入需要设置的用户名称或ID", e_context)
+        index = -1
+        for i, user in enumerate(users):
+            if user == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 用户[{user_name}]已在白名单中", e_context)
+        for i, user in enumerate(busers):
+            if user == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 用户[{user_name}]已在黑名单中，如需添加请先移除黑名单", e_context)
+        # 判断是否是itchat平台
+        if conf().get("channel_type", "wx") == "wx":
+            userInfo = search_friends(user_name)
+            # 判断user_name是否在列表中
+            if not userInfo or not userInfo["user_id"]:
+                return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
+        users.append(user_name)
+        self.roll["mj_users"] = users
+        self.roll_add("mj_users", user_name)
+        return Info(f"[MJ] 用户[{user_name}]已添加到白名单", e_context)
+
+    @roll_locked
+    def cmd_mj_s_buser(self, e_context: EventContext, args):
+        user_name = args[0] if args and args[0] else ""
+        users = self.roll["mj_users"]
+        busers = self.roll["mj_busers"]
+        if not args or len(args) < 1:
+            return Error("[MJ] 请输入需要设置的用户名称或ID", e_context)
+        index = -1
+        for i, user in enumerate(users):
+            if user == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 用户[{user_name}]已在白名单中，如需添加请先移除白名单", e_context)
+        for i, user in enumerate(busers):
+            if user == user_name:
+                index = i
+                break
+        if index >= 0:
+            return Error(f"[MJ] 用户[{user_name}]已在黑名单中", e_context)
+        # 判断是否是itchat平台
+        if conf().get("channel_type", "wx") == "wx":
+            userInfo = search_friends(user_name)
+            # 判断user_name是否在列表中
+            if not userInfo or not userInfo["user_id"]:
+                return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
+        busers.append(user_name)
+        self.roll["mj_busers"] = busers
+        self.roll_add("mj_busers", user_name)
+        return Info(f"[MJ] 用户[{user_name}]已添加到黑名单", e_context)
+
+    @roll_locked
+    def cmd_mj_r_wuser(self, e_context: EventContext, args):
+        text = ""
+        users = self.roll["mj_users"]
+        if len(args) < 1:
+            return Error("[MJ] 请输入需要移除的用户名称或ID或序列号", e_context)
+        if args and args[0]:
+            if args[0].isdigit():
+                index = int(args[0]) - 1
+                if index < 0 or index >= len(users):
+                    return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
+                user_name = users[index]
+                del users[index]
                 self.roll["mj_users"] = users
-                write_pickle(self.roll_path, self.roll)
-                return Info(f"[MJ] 用户[{user_name}]已添加到白名单", e_context)
-            elif cmd == "mj_s_buser":
-                user_name = args[0] if args and args[0] else ""
-                users = self.roll["mj_users"]
-                busers = self.roll["mj_busers"]
-                if not args or len(args) < 1:
-                    return Error("[MJ] 请输入需要设置的用户名称或ID", e_context)
+                self.roll_remove("mj_users", user_name)
+                text = f"[MJ] 用户[{user_name}]已从白名单中移除"
+            else:
+                user_name = args[0]
                 index = -1
                 for i, user in enumerate(users):
                     if user == user_name:
                         index = i
                         break
                 if index >= 0:
-                    return Error(f"[MJ] 用户[{user_name}]已在白名单中，如需添加请先移除白名单", e_context)
+                    del users[index]
+                    text = f"[MJ] 用户[{user_name}]已从白名单中移除"
+                    self.roll["mj_users"] = users
+                    self.roll_remove("mj_users", user_name)
+                else:
+                    return Error(f"[MJ] 用户[{user_name}]不在白名单中", e_context)
+        return Info(text, e_context)
+
+    @roll_locked
+    def cmd_mj_r_buser(self, e_context: EventContext, args):
+        text = ""
+        busers = self.roll["mj_busers"]
+        if len(args) < 1:
+            return Error("[MJ] 请输入需要移除的用户名称或ID或序列号", e_context)
+        if args and args[0]:
+            if args[0].isdigit():
+                index = int(args[0]) - 1
+                if index < 0 or index >= len(busers):
+                    return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
+                user_name = busers[index]
+                del busers[index]
+                self.roll["mj_busers"] = busers
+                self.roll_remove("mj_busers", user_name)
+                text = f"[MJ] 用户[{user_name}]已从黑名单中移除"
+            else:
+                user_name = args[0]
+                index = -1
                 for i, user in enumerate(busers):
                     if user == user_name:
                         index = i
                         break
                 if index >= 0:
-                    return Error(f"[MJ] 用户[{user_name}]已在黑名单中", e_context)
-                # 判断是否是itchat平台
-                if conf().get("channel_type", "wx") == "wx":
-                    userInfo = search_friends(user_name)
-                    # 判断user_name是否在列表中
-                    if not userInfo or not userInfo["user_id"]:
-                        return Error(f"[MJ] 用户[{user_name}]不存在通讯录中", e_context)
-                busers.append(user_name)
-                self.roll["mj_busers"] = busers
-                write_pickle(self.roll_path, self.roll)
-                return Info(f"[MJ] 用户[{user_name}]已添加到黑名单", e_context)
-            elif cmd == "mj_r_wuser":
-                text = ""
-                users = self.roll["mj_users"]
-                if len(args) < 1:
-                    return Error("[MJ] 请输入需要移除的用户名称或ID或序列号", e_context)
-                if args and args[0]:
-                    if args[0].isdigit():
-                        index = int(args[0]) - 1
-                        if index < 0 or index >= len(users):
-                            return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
-                        user_name = users[index]
-                        del users[index]
-                        self.roll["mj_users"] = users
-                        write_pickle(self.roll_path, self.roll)
-                        text = f"[MJ] 用户[{user_name}]已从白名单中移除"
-                    else:
-                        user_name = args[0]
-                        index = -1
-                        for i, user in enumerate(users):
-                            if user == user_name:
-                                index = i
-                                break
-                        if index >= 0:
-                            del users[index]
-                            text = f"[MJ] 用户[{user_name}]已从白名单中移除"
-                            self.roll["mj_users"] = users
-                            write_pickle(self.roll_path, self.roll)
-                        else:
-                            return Error(f"[MJ] 用户[{user_name}]不在白名单中", e_context)
-                return Info(text, e_context)
-            elif cmd == "mj_r_buser":
-                text = ""
-                busers = self.roll["mj_busers"]
-                if len(args) < 1:
-                    return Error("[MJ] 请输入需要移除的用户名称或ID或序列号", e_context)
-                if args and args[0]:
-                    if args[0].isdigit():
-                        index = int(args[0]) - 1
-                        if index < 0 or index >= len(busers):
-                            return Error(f"[MJ] 序列号[{args[0]}]不存在", e_context)
-                        user_name = busers[index]
-                        del busers[index]
-                        self.roll["mj_busers"] = busers
-                        write_pickle(self.roll_path, self.roll)
-                        text = f"[MJ] 用户[{user_name}]已从黑名单中移除"
-                    else:
-                        user_name = args[0]
-                        index = -1
-                        for i, user in enumerate(busers):
-                            if user == user_name:
-                                index = i
-                                break
-                        if index >= 0:
-                            del busers[index]
-                            text = f"[MJ] 用户[{user_name}]已从黑名单中移除"
-                            self.roll["mj_busers"] = busers
-                            write_pickle(self.roll_path, self.roll)
-                        else:
-                            return Error(f"[MJ] 用户[{user_name}]不在黑名单中", e_context)
-                return Info(text, e_context)
-            else:
-                return "Bye"
-                
+                    del busers[index]
+                    text = f"[MJ] 用户[{user_name}]已从黑名单中移除"
+                    self.roll["mj_busers"] = busers
+                    self.roll_remove("mj_busers", user_name)
+                else:
+                    return Error(f"[MJ] 用户[{user_name}]不在黑名单中", e_context)
+        return Info(text, e_context)
+
+    # 名单修改同时写入存储并更新索引
+    def roll_add(self, name, item):
+        self.user_store.roll_add(name, item)
+        self.roll_index.add(name, item)
+
+    def roll_remove(self, name, item):
+        self.user_store.roll_remove(name, item)
+        self.roll_index.remove(name, item)
+
+    def roll_clear(self, name):
+        self.user_store.roll_clear(name)
+        self.roll_index.clear(name)
+
+    @roll_locked
     def authenticate(self, userInfo, args) -> Tuple[bool, str]:
         isgroup = userInfo["isgroup"]
         isadmin = userInfo["isadmin"]
@@ -1045,11 +1554,12 @@ class Midjourney(Plugin):
 
         password = args[0]
         if password == self.config['mj_admin_password']:
-            self.roll["mj_admin_users"].append({
+            adminUser = {
                 "user_id": userInfo["user_id"],
                 "user_nickname": userInfo["user_nickname"]
-            })
-            write_pickle(self.roll_path, self.roll)
+            }
+            self.roll["mj_admin_users"].append(adminUser)
+            self.roll_add("mj_admin_users", adminUser)
             return True, f"[MJ] 认证成功"
         else:
             return False, "[MJ] 认证失败"
@@ -1060,24 +1570,12 @@ class Midjourney(Plugin):
             current_timestamp = time.time()
             # 将当前时间戳和给定时间戳转换为日期字符串
             current_date = time.strftime("%Y-%m-%d", time.localtime(current_timestamp))
-            groups = self.roll["mj_groups"]
-            bgroups = self.roll["mj_bgroups"]
-            users = self.roll["mj_users"]
-            logger.debug(f"[MJ] Type of users: {type(users)}, Content: {users}")
-            busers = self.roll["mj_busers"]
-            mj_admin_users = self.roll["mj_admin_users"]
             context = e_context['context']
             msg: ChatMessage = context["msg"]
             isgroup = context.get("isgroup", False)
             # 写入用户信息，企业微信没有from_user_nickname，所以使用from_user_id代替
             uid = msg.from_user_id if not isgroup else msg.actual_user_id
             uname = (msg.from_user_nickname if msg.from_user_nickname else uid) if not isgroup else msg.actual_user_nickname
-            logger.debug(f"[MJ] UID: {uid}, User data keys: {list(self.user_datas.keys())}")
-            if uid not in self.user_datas:
-                logger.warning(f"[MJ] UID: {uid} not found in user_datas")
-            else:
-                logger.debug(f"[MJ] Found UID: {uid}, Data: {self.user_datas[uid]}")
-
             userInfo = {
                 "user_id": uid,
                 "user_nickname": uname,
@@ -1085,44 +1583,34 @@ class Midjourney(Plugin):
                 "group_id": msg.from_user_id if isgroup else "",
                 "group_name": msg.from_user_nickname if isgroup else "",
             }
-            # 判断是否是新的一天
-            logger.debug(f"[MJ] UID: {uid}, Type of self.user_datas[uid]: {type(self.user_datas.get(uid))}, Content: {self.user_datas.get(uid)}")
-            if uid not in self.user_datas or "mj_data" not in self.user_datas[uid] or "mj_data" not in self.user_datas[uid] or self.user_datas[uid]["mj_data"]["time"] != current_date:
-                mj_data = {
-                    "limit": self.config["daily_limit"],
-                    "time": current_date,
-                    "nickname": uname  # 在这里添加 nickname 字段
-                }
-                if uid in self.user_datas and self.user_datas[uid]["mj_data"]:
-                    self.user_datas[uid]["mj_data"] = mj_data
+            # 每日重置和次数读取与 consume_limit 互斥，避免并发消息覆盖扣减结果
+            with self.user_lock:
+                if uid not in self.user_datas:
+                    logger.warning("[MJ] UID: %s not found in user_datas", uid)
                 else:
-                    self.user_datas[uid] = {
-                        "mj_data": mj_data
+                    logger.debug("[MJ] Found UID: %s, Data: %s", uid, self.user_datas[uid])
+
+                # 判断是否是新的一天
+                if uid not in self.user_datas or "mj_data" not in self.user_datas[uid] or "mj_data" not in self.user_datas[uid] or self.user_datas[uid]["mj_data"]["time"] != current_date:
+                    mj_data = {
+                        "limit": self.config["daily_limit"],
+                        "time": current_date,
+                        "nickname": uname  # 在这里添加 nickname 字段
                     }
-                write_pickle(self.user_datas_path, self.user_datas)
-
-            limit = self.user_datas[uid]["mj_data"]["limit"] if "mj_data" in self.user_datas[uid] and "limit" in self.user_datas[uid]["mj_data"] and self.user_datas[uid]["mj_data"]["limit"] and self.user_datas[uid]["mj_data"]["limit"] > 0 else False
-            userInfo['limit'] = limit
-            userInfo['isadmin'] = uid in [user["user_id"] for user in mj_admin_users]
-
-            # 判断白名单用户
-            if isinstance(users, list):
-                if all(isinstance(user, dict) for user in users):
-                    userInfo['iswuser'] = uname in [user["user_nickname"] for user in users]
-                else:
-                    userInfo['iswuser'] = uname in users  # users 中为字符串时
-            else:
-                userInfo['iswuser'] = False
-            
-            # 判断黑名单用户
-            if isinstance(busers, list):
-                if all(isinstance(user, dict) for user in busers):
-                    userInfo['isbuser'] = uname in [user["user_nickname"] for user in busers]
-                else:
-                    userInfo['isbuser'] = uname in busers  # busers 中为字符串时
-            else:
-                userInfo['isbuser'] = False
-            
-            userInfo['iswgroup'] = userInfo["group_name"] in groups
-            userInfo['isbgroup'] = userInfo["group_name"] in bgroups
+                    if uid in self.user_datas and self.user_datas[uid]["mj_data"]:
+                        self.user_datas[uid]["mj_data"] = mj_data
+                    else:
+                        self.user_datas[uid] = {
+                            "mj_data": mj_data
+                        }
+                    self.user_store.save_user(uid, self.user_datas[uid])
+
+                limit = self.user_datas[uid]["mj_data"]["limit"] if "mj_data" in self.user_datas[uid] and "limit" in self.user_datas[uid]["mj_data"] and self.user_datas[uid]["mj_data"]["limit"] and self.user_datas[uid]["mj_data"]["limit"] > 0 else False
+                userInfo['limit'] = limit
+            # 通过名单索引判断权限，名单项可能是用户ID、昵称或包含二者的字典
+            userInfo['isadmin'] = self.roll_index.contains("mj_admin_users", uid)
+            userInfo['iswuser'] = self.roll_index.contains("mj_users", uname, uid)
+            userInfo['isbuser'] = self.roll_index.contains("mj_busers", uname, uid)
+            userInfo['iswgroup'] = self.roll_index.contains("mj_groups", userInfo["group_name"])
+            userInfo['isbgroup'] = self.roll_index.contains("mj_bgroups", userInfo["group_name"])
             return userInfo
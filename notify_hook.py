@@ -0,0 +1,77 @@
+# encoding:utf-8
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from common.log import logger
+
+TOKEN_PARAM = "token"
+TOKEN_HEADER = "X-MJ-Notify-Token"
+
+
+def with_token(url, secret):
+    """在提交给代理的回调地址上附加口令参数"""
+    sep = "&" if urlsplit(url).query else "?"
+    return url + sep + urlencode({TOKEN_PARAM: secret})
+
+
+class NotifyHookServer:
+    """接收 midjourney-proxy notifyHook 回调的轻量 HTTP 服务
+
+    回调需要在地址参数或请求头中携带口令，口令不符的请求直接拒绝。
+    """
+
+    def __init__(self, host, port, path, secret, callback):
+        self.path = path
+        self.secret = secret
+        self.callback = callback
+        hook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if url.path != hook.path:
+                    self.send_error(404)
+                    return
+                token = self.headers.get(TOKEN_HEADER) or parse_qs(url.query).get(TOKEN_PARAM, [""])[0]
+                if not hook.authorized(token):
+                    logger.warning("[MJ] notify hook rejected unauthorized request from %s", self.client_address[0])
+                    self.send_error(403)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    task = json.loads(self.rfile.read(length))
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"[MJ] invalid notify hook body: {e}")
+                    self.send_error(400)
+                    return
+                # 先应答代理，再处理任务，避免下载图片时代理回调超时
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                if isinstance(task, dict) and task.get("id"):
+                    try:
+                        hook.callback(task)
+                    except Exception as e:
+                        logger.exception("[MJ] notify hook handle failed: %s" % e)
+
+            def log_message(self, format, *args):
+                logger.debug("[MJ] notify hook: " + format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mj-notify-hook", daemon=True)
+
+    def authorized(self, token):
+        return bool(self.secret) and hmac.compare_digest(token.encode("utf-8"), self.secret.encode("utf-8"))
+
+    def start(self):
+        self.thread.start()
+        logger.info("[MJ] notify hook listening on %s:%s%s", *self.server.server_address[:2], self.path)
+
+    def shutdown(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,126 @@
+# encoding:utf-8
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.log import logger
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
+from .metrics import PROXY_LATENCY
+
+# 默认的连接池与超时配置，可在 config.json 中覆盖
+DEFAULT_PROXY_CONF = {
+    "proxy_pool_size": 20,
+    "proxy_connect_timeout": 5,
+    "proxy_read_timeout": 30,
+    # 按接口单独设置 [连接超时, 读取超时]，未列出的接口使用上面的默认值
+    "proxy_endpoint_timeouts": {
+        "/submit/imagine": [5, 60],
+        "/submit/describe": [5, 60],
+        "/task/list-by-condition": [5, 15],
+        "/task/{id}/fetch": [5, 10],
+        "/task/{id}/image-seed": [5, 10],
+    },
+    "proxy_retry_total": 2,
+    "proxy_retry_backoff": 0.5,
+    # 备用代理地址，主地址熔断或连接失败时切换
+    "proxy_backup_server": "",
+}
+
+
+class ProxyClient:
+    """midjourney-proxy 客户端，所有代理请求共用一个长连接池，每个代理地址有独立的熔断器"""
+
+    def __init__(self, proxy_server, proxy_api_secret, config=None, backup_server=None, name="default"):
+        config = {**DEFAULT_PROXY_CONF, **(config or {})}
+        self.proxy_server = proxy_server
+        self.proxy_api_secret = proxy_api_secret
+        self.endpoints = [(proxy_server, CircuitBreaker(f"{name}:primary", config))]
+        if backup_server:
+            self.endpoints.append((backup_server, CircuitBreaker(f"{name}:backup", config)))
+        self.default_timeout = (config["proxy_connect_timeout"], config["proxy_read_timeout"])
+        self.endpoint_timeouts = {
+            path: tuple(timeout) for path, timeout in (config.get("proxy_endpoint_timeouts") or {}).items()
+        }
+        # POST 提交不是幂等的，只在连接阶段失败时重试（urllib3 默认不重试 POST 的读取错误）
+        retries = Retry(
+            total=config["proxy_retry_total"],
+            backoff_factor=config["proxy_retry_backoff"],
+            status_forcelist=[502, 503, 504],
+        )
+        pool_size = config["proxy_pool_size"]
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=retries)
+        self.session = requests.Session()
+        self.session.headers.update({"mj-api-secret": self.proxy_api_secret})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout_for(self, endpoint):
+        return self.endpoint_timeouts.get(endpoint, self.default_timeout)
+
+    def post_json(self, api_path, data, endpoint=None):
+        return self.request("POST", api_path, endpoint, json=data)
+
+    def get_json(self, api_path, endpoint=None):
+        return self.request("GET", api_path, endpoint)
+
+    def request(self, method, api_path, endpoint=None, **kwargs):
+        """依次尝试可用的代理地址，全部熔断时抛出 CircuitOpenError
+
+        只有连接失败、超时、5xx 和慢调用计入熔断；2xx 的空响应或非 JSON 响应（如查询不存在的任务ID）返回 None。
+        """
+        endpoint = endpoint or api_path
+        timeout = self.timeout_for(endpoint)
+        last_error = None
+        for server, breaker in self.endpoints:
+            if not breaker.allow():
+                continue
+            start = time.time()
+            try:
+                res = self.session.request(method, server + api_path, timeout=timeout, **kwargs)
+                if res.status_code >= 500:
+                    raise requests.exceptions.HTTPError(f"{res.status_code} from {server}", response=res)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                PROXY_LATENCY.observe(time.time() - start, endpoint, "error")
+                breaker.record(False, time.time() - start)
+                # 提交接口不是幂等的，只有确定没有连上时才切换到备用地址，避免重复提交
+                if method != "GET" and not isinstance(e, requests.exceptions.ConnectionError):
+                    raise
+                last_error = e
+                continue
+            PROXY_LATENCY.observe(time.time() - start, endpoint, "ok")
+            breaker.record(True, time.time() - start)
+            try:
+                return res.json()
+            except ValueError:
+                if not res.ok:
+                    raise requests.exceptions.HTTPError(f"{res.status_code} from {server}", response=res)
+                logger.debug(f"[MJ] empty or non-JSON response from {server}{api_path}")
+                return None
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError(f"proxy {self.proxy_server} circuit open")
+
+    def available(self):
+        return any(breaker.available() for _, breaker in self.endpoints)
+
+    def probe(self):
+        """对已熔断且过了冷却时间的地址发一次轻量请求，成功则恢复"""
+        for server, breaker in self.endpoints:
+            if breaker.state == CLOSED or not breaker.allow():
+                continue
+            start = time.time()
+            try:
+                res = self.session.post(server + "/task/list-by-condition", json={"ids": []},
+                                        timeout=self.timeout_for("/task/list-by-condition"))
+                ok = res.status_code < 500
+            except requests.exceptions.RequestException as e:
+                logger.debug(f"[MJ] probe {server} failed: {e}")
+                ok = False
+            breaker.record(ok, time.time() - start)
+
+    def close(self):
+        self.session.close()
+        logger.debug("[MJ] proxy client closed")
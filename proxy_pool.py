@@ -0,0 +1,114 @@
+# encoding:utf-8
+import threading
+from collections import OrderedDict
+
+from common.log import logger
+from .proxy_client import ProxyClient
+from .circuit_breaker import CircuitOpenError
+
+DEFAULT_POOL_CONF = {
+    # 多个代理账号：[{"name": "a", "proxy_server": "...", "proxy_api_secret": "...", "max_concurrent": 3,
+    #               "backup_server": "..."}]
+    # 为空时使用 proxy_server / proxy_api_secret 作为唯一账号
+    "proxy_accounts": [],
+    "proxy_max_concurrent": 3,
+}
+
+DEFAULT_ACCOUNT = "default"
+
+
+class ProxyPool:
+    """多个代理账号的调度器，按并发槽位把新任务分给最空闲的账号，并记录任务所属账号"""
+
+    def __init__(self, config, max_owners=10000):
+        accounts = config.get("proxy_accounts") or [{
+            "name": DEFAULT_ACCOUNT,
+            "proxy_server": config.get("proxy_server"),
+            "proxy_api_secret": config.get("proxy_api_secret"),
+            "backup_server": config.get("proxy_backup_server"),
+        }]
+        self.clients = OrderedDict()
+        self.limits = {}
+        self.active = {}
+        for i, account in enumerate(accounts):
+            name = account.get("name") or f"account{i}"
+            self.clients[name] = ProxyClient(account["proxy_server"], account["proxy_api_secret"], config,
+                                             account.get("backup_server"), name)
+            self.limits[name] = max(1, account.get("max_concurrent") or config.get("proxy_max_concurrent"))
+            self.active[name] = 0
+        self.lock = threading.Lock()
+        self.owners = OrderedDict()  # task_id -> 账号名
+        self.max_owners = max_owners
+
+    def names(self):
+        return list(self.clients)
+
+    def client(self, name):
+        return self.clients.get(name) or next(iter(self.clients.values()))
+
+    def available(self, name=None):
+        """指定账号或任一账号是否可用（未熔断）"""
+        if name in self.clients:
+            return self.clients[name].available()
+        return any(client.available() for client in self.clients.values())
+
+    def acquire(self, name=None):
+        """占用一个槽位并返回账号名；未指定账号时在未熔断的账号中选择负载最低的，全部占满时仍选最空闲的"""
+        with self.lock:
+            if name not in self.clients:
+                candidates = [n for n, client in self.clients.items() if client.available()]
+                if not candidates:
+                    raise CircuitOpenError("all proxy accounts are unavailable")
+                name = min(candidates, key=lambda n: (self.active[n] / self.limits[n], self.active[n]))
+            self.active[name] += 1
+            if self.active[name] > self.limits[name]:
+                logger.info(f"[MJ] proxy account {name} over capacity [{self.active[name]}/{self.limits[name]}]")
+            return name
+
+    def release(self, name):
+        with self.lock:
+            if self.active.get(name, 0) > 0:
+                self.active[name] -= 1
+
+    def assign(self, task_id, name):
+        """记录任务所属账号，后续查询和 /up 动作都发往该账号"""
+        if not task_id or name not in self.clients:
+            return
+        with self.lock:
+            self.owners[task_id] = name
+            self.owners.move_to_end(task_id)
+            while len(self.owners) > self.max_owners:
+                self.owners.popitem(last=False)
+
+    def owner(self, task_id):
+        with self.lock:
+            return self.owners.get(task_id)
+
+    def find_owner(self, task_id):
+        """本地没有记录时（如重启后的旧任务）逐个账号查询，返回 (账号名, 任务)"""
+        name = self.owner(task_id)
+        if name or len(self.clients) == 1:
+            name = name or next(iter(self.clients))
+            return name, self.clients[name].get_json('/task/%s/fetch' % task_id, endpoint='/task/{id}/fetch')
+        for name, client in self.clients.items():
+            try:
+                task = client.get_json('/task/%s/fetch' % task_id, endpoint='/task/{id}/fetch')
+            except Exception as e:
+                logger.warning(f"[MJ] fetch task {task_id} from {name} failed: {e}")
+                continue
+            if task:
+                self.assign(task_id, name)
+                return name, task
+        return None, None
+
+    def probe(self):
+        for client in self.clients.values():
+            client.probe()
+
+    def load(self):
+        with self.lock:
+            return {name: (self.active[name], self.limits[name]) for name in self.clients}
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
@@ -0,0 +1,74 @@
+# encoding:utf-8
+import math
+import threading
+import time
+
+DEFAULT_RATE_LIMIT_CONF = {
+    "rate_limit_enabled": True,
+    "user_rate_per_min": 3,  # 每个用户每分钟补充的提交次数
+    "user_burst": 5,  # 每个用户最多可连续提交的次数
+    "group_rate_per_min": 10,
+    "group_burst": 15,
+}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min, burst, now):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """还需等待多少秒才有一个令牌，调用前需先 refill"""
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按用户和群组分别限流的令牌桶，两个桶都有令牌时才放行"""
+
+    def __init__(self, user_rate_per_min, user_burst, group_rate_per_min, group_burst, idle_seconds=3600):
+        self.user_conf = (user_rate_per_min, user_burst)
+        self.group_conf = (group_rate_per_min, group_burst)
+        self.idle_seconds = idle_seconds
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_prune = time.time()
+
+    def bucket(self, key, conf, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(conf[0], conf[1], now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def acquire(self, user_id, group_id=None, now=None):
+        """尝试占用一次提交额度，返回 (是否放行, 建议等待秒数)"""
+        now = now or time.time()
+        with self.lock:
+            buckets = [self.bucket(("u", user_id), self.user_conf, now)]
+            if group_id:
+                buckets.append(self.bucket(("g", group_id), self.group_conf, now))
+            wait = max(b.wait_time() for b in buckets)
+            if wait == 0:
+                for b in buckets:
+                    b.tokens -= 1
+            self.prune(now)
+        return wait == 0, wait
+
+    def prune(self, now):
+        # 定期清理长时间未使用的桶，调用方需持有 self.lock
+        if now - self.last_prune < self.idle_seconds:
+            return
+        self.last_prune = now
+        for key in [k for k, b in self.buckets.items() if now - b.updated > self.idle_seconds]:
+            del self.buckets[key]
@@ -0,0 +1,89 @@
+# encoding:utf-8
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+DEFAULT_RESULT_CACHE_CONF = {
+    "result_cache_enabled": True,
+    "result_cache_size": 512,
+    "result_cache_ttl": 24 * 60 * 60,
+}
+
+
+def image_dhash(img_data, hash_size=8):
+    """差值感知哈希，转发、压缩过的同一张图得到相同的哈希"""
+    image = Image.open(io.BytesIO(img_data)).convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return "%0*x" % (hash_size * hash_size // 4, bits)
+
+
+class ResultCache:
+    """/describe 和 /shorten 的结果缓存，容量有限，按 LRU 淘汰并带过期时间"""
+
+    def __init__(self, maxsize=512, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (过期时间, 任务结果)
+        self.pending = {}  # task_id -> (key, 提交时间)，任务完成后写入缓存
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result, now=None):
+        now = now or time.time()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def expect(self, task_id, key, now=None):
+        """记录已提交任务对应的缓存键"""
+        now = now or time.time()
+        with self.lock:
+            self.pending[task_id] = (key, now)
+            # 未完成就过期的任务不会回调，顺带清理
+            for tid in [t for t, (_, ts) in self.pending.items() if now - ts > self.ttl]:
+                del self.pending[tid]
+
+    def complete(self, task):
+        """任务成功后按提交时的键缓存结果"""
+        with self.lock:
+            pending = self.pending.pop(task['id'], None)
+        if pending is None:
+            return
+        self.put(pending[0], {
+            'id': task['id'],
+            'action': task.get('action'),
+            'properties': {'finalPrompt': (task.get('properties') or {}).get('finalPrompt')},
+            'buttons': task.get('buttons') or [],
+        })
+
+    def discard(self, task_id):
+        with self.lock:
+            self.pending.pop(task_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
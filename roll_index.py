@@ -0,0 +1,45 @@
+# encoding:utf-8
+from collections import Counter
+
+from .user_store import ROLL_NAMES
+
+
+def item_keys(name, item):
+    """名单项对应的索引键：管理员只按用户ID匹配，其他用户名单按ID或昵称匹配"""
+    if isinstance(item, dict):
+        if name == "mj_admin_users":
+            return {item.get("user_id")}
+        return {item.get("user_id"), item.get("user_nickname")} - {None}
+    return {item}
+
+
+class RollIndex:
+    """名单的哈希索引，管理员指令增删时增量维护，成员判断为 O(1)"""
+
+    def __init__(self, roll=None):
+        self.index = {name: Counter() for name in ROLL_NAMES}
+        if roll:
+            self.rebuild(roll)
+
+    def rebuild(self, roll):
+        for name in ROLL_NAMES:
+            self.index[name] = Counter()
+            for item in roll.get(name) or []:
+                self.add(name, item)
+
+    def add(self, name, item):
+        self.index[name].update(item_keys(name, item))
+
+    def remove(self, name, item):
+        counter = self.index[name]
+        counter.subtract(item_keys(name, item))
+        for key in item_keys(name, item):
+            if counter[key] <= 0:
+                del counter[key]
+
+    def clear(self, name):
+        self.index[name] = Counter()
+
+    def contains(self, name, *keys):
+        counter = self.index[name]
+        return any(key in counter for key in keys if key)
@@ -0,0 +1,43 @@
+# encoding:utf-8
+from collections import namedtuple
+
+# kind: "command"（$ 管理指令）或 "slash"（/ 绘图指令）
+Route = namedtuple("Route", ["kind", "name", "handler", "admin", "args"])
+
+
+class CommandRouter:
+    """启动时编译的指令路由表，先按首字符快速排除与插件无关的消息，再用字典查找处理函数"""
+
+    def __init__(self, trigger_prefix="$"):
+        self.trigger_prefix = trigger_prefix
+        self.commands = {}  # 别名 -> (指令名, 处理函数, 是否管理员指令)
+        self.slash = {}     # /指令 -> (处理函数, 是否带参数)
+        self.lead_chars = frozenset(("/", trigger_prefix[:1]))
+
+    def add_command(self, aliases, name, handler, admin=False):
+        for alias in aliases:
+            self.commands[alias] = (name, handler, admin)
+
+    def add_slash(self, cmd, handler, with_args=True):
+        self.slash[cmd] = (handler, with_args)
+
+    def match(self, content):
+        """返回匹配到的 Route，与插件无关的消息返回 None"""
+        if not content or content[0] not in self.lead_chars:
+            return None
+        if content.startswith(self.trigger_prefix):
+            com = content[len(self.trigger_prefix):].strip().split()
+            entry = self.commands.get(com[0]) if com else None
+            if entry is None:
+                return None
+            name, handler, admin = entry
+            return Route("command", name, handler, admin, com[1:])
+        # /imagine 等指令需要以空格分隔参数，/describe 不带参数
+        head, sep, rest = content.partition(" ")
+        entry = self.slash.get(head)
+        if entry is None:
+            return None
+        handler, with_args = entry
+        if with_args != bool(sep):
+            return None
+        return Route("slash", head, handler, False, rest)
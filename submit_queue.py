@@ -0,0 +1,66 @@
+# encoding:utf-8
+import threading
+from collections import OrderedDict, deque
+
+from common.log import logger
+
+
+class SubmitQueue:
+    """有界提交队列，由固定数量的工作线程调用代理接口，避免阻塞消息线程
+
+    任务按 key（群聊为群ID，私聊为用户ID）分组，工作线程在各组之间轮流取任务，
+    一个繁忙的群不会占满整个队列。
+    """
+
+    def __init__(self, workers=4, maxsize=50):
+        self.maxsize = maxsize
+        self.cond = threading.Condition()
+        self.queues = OrderedDict()  # key -> deque，队首的 key 下一次被服务
+        self.size = 0
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"mj-submit-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, fn, *args, fair_key=None, **kwargs) -> bool:
+        """放入队列，队列已满时立即返回 False"""
+        with self.cond:
+            if self.size >= self.maxsize:
+                logger.warning("[MJ] submit queue is full, size [%s]", self.size)
+                return False
+            self.queues.setdefault(fair_key, deque()).append((fn, args, kwargs))
+            self.size += 1
+            self.cond.notify()
+        return True
+
+    def pending(self):
+        return self.size
+
+    def ahead(self, fair_key=None):
+        """按轮询顺序估算新任务前面还有多少个任务"""
+        with self.cond:
+            own = len(self.queues.get(fair_key, ()))
+            return own + sum(min(len(q), own + 1) for key, q in self.queues.items() if key != fair_key)
+
+    def _take(self):
+        with self.cond:
+            while self.size == 0:
+                self.cond.wait()
+            key, q = next(iter(self.queues.items()))
+            job = q.popleft()
+            self.size -= 1
+            # 服务过的组移到队尾
+            if q:
+                self.queues.move_to_end(key)
+            else:
+                del self.queues[key]
+            return job
+
+    def _worker(self):
+        while True:
+            fn, args, kwargs = self._take()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.exception("[MJ] submit job failed: %s" % e)
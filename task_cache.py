@@ -0,0 +1,59 @@
+# encoding:utf-8
+import threading
+from collections import OrderedDict
+
+# 已完成任务中后续指令会用到的字段
+TASK_FIELDS = ("id", "action", "status", "prompt", "description", "imageUrl", "buttons")
+
+
+class TaskCache:
+    """已完成任务的元数据缓存（按钮、图片地址、提示词、seed），容量有限，按 LRU 淘汰"""
+
+    def __init__(self, maxsize=2000):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.tasks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task_id):
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record is None:
+                self.misses += 1
+                return None
+            self.tasks.move_to_end(task_id)
+            self.hits += 1
+            return record
+
+    def put(self, task):
+        """只缓存已成功的任务，完成后的按钮和图片不会再变化"""
+        if not task or task.get('status') != 'SUCCESS':
+            return
+        record = {field: task.get(field) for field in TASK_FIELDS}
+        record['properties'] = {'finalPrompt': (task.get('properties') or {}).get('finalPrompt')}
+        with self.lock:
+            old = self.tasks.get(task['id'])
+            record['seed'] = old.get('seed') if old else None
+            self.tasks[task['id']] = record
+            self.tasks.move_to_end(task['id'])
+            while len(self.tasks) > self.maxsize:
+                self.tasks.popitem(last=False)
+
+    def get_seed(self, task_id):
+        record = self.get(task_id)
+        return record.get('seed') if record else None
+
+    def set_seed(self, task_id, seed):
+        with self.lock:
+            record = self.tasks.get(task_id)
+            if record is None:
+                # 任务详情不在缓存中时只记录 seed
+                record = self.tasks[task_id] = {'id': task_id, 'status': None}
+                while len(self.tasks) > self.maxsize:
+                    self.tasks.popitem(last=False)
+            record['seed'] = seed
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.tasks)}
@@ -0,0 +1,145 @@
+# encoding:utf-8
+import threading
+import time
+
+from common.log import logger
+
+# 默认轮询间隔（秒），可在 config.json 的 poll_intervals 中覆盖
+DEFAULT_POLL_INTERVALS = {
+    "first": 3,        # 提交后第一次查询
+    "queued": 15,      # NOT_START / SUBMITTED 等排队中的任务
+    "in_progress": 5,  # 执行中的任务
+    "near_done": 2,    # 进度达到 poll_near_done_progress 的任务
+    "fast_action": 2,  # DESCRIBE / SHORTEN 等很快完成的任务
+}
+
+QUEUED_STATUS = ("NOT_START", "SUBMITTED", "MODAL")
+FAST_ACTIONS = ("DESCRIBE", "SHORTEN")
+
+
+def parse_progress(progress):
+    """将 '45%' 形式的进度转换为整数，无法解析时返回 0"""
+    try:
+        return int(str(progress).rstrip("%"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class TaskPoller:
+    """记录每个任务的下次查询时间，根据动作类型、状态和进度自适应调整轮询间隔"""
+
+    def __init__(self, intervals=None, near_done_progress=80, expires_in_seconds=60 * 60, store=None, on_expire=None):
+        self.intervals = {**DEFAULT_POLL_INTERVALS, **(intervals or {})}
+        self.near_done_progress = near_done_progress
+        self.expires_in_seconds = expires_in_seconds
+        self.store = store
+        self.on_expire = on_expire  # 任务超时未完成时回调 on_expire(task_id, info)
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Event()  # 有新任务加入时唤醒轮询线程
+        if self.store:
+            self.restore()
+
+    def restore(self):
+        """从持久化存储恢复未完成的任务，启动后立即查询一次"""
+        self.store.compact(self.expires_in_seconds)
+        now = time.time()
+        with self.lock:
+            for row in self.store.load():
+                self.tasks[row["task_id"]] = {
+                    "state": row["state"],
+                    "user_id": row["user_id"],
+                    "status": row["status"],
+                    "action": row["action"],
+                    "progress": 0,
+                    "submit_time": row["submit_time"],
+                    "next_due": now,
+                    "account": row["account"],
+                }
+        if self.tasks:
+            logger.info("[MJ] restored %s pending tasks", len(self.tasks))
+
+    def add(self, task_id, status="NOT_START", state=None, user_id=None, action=None, account=None):
+        now = time.time()
+        interval = self.intervals["queued"] if status == "SUBMITTED" else self.intervals["first"]
+        with self.lock:
+            self.tasks[task_id] = {
+                "state": state,
+                "user_id": user_id,
+                "status": status,
+                "action": action,
+                "progress": 0,
+                "submit_time": now,
+                "next_due": now + interval,
+                "account": account,
+            }
+        if self.store:
+            self.store.add(task_id, state, user_id, action, status, now, account)
+        self.changed.set()
+
+    def remove(self, task_id):
+        """移除任务并返回其记录，任务已不在跟踪中时返回 None，用于保证完成通知只处理一次"""
+        with self.lock:
+            info = self.tasks.pop(task_id, None)
+        if info is not None and self.store:
+            self.store.remove(task_id)
+        return info
+
+    def pop_due(self, now=None):
+        """返回所有已到期的任务ID，并清理过期任务"""
+        now = now or time.time()
+        due = []
+        expired = []
+        with self.lock:
+            for task_id, info in list(self.tasks.items()):
+                if now - info["submit_time"] > self.expires_in_seconds:
+                    del self.tasks[task_id]
+                    expired.append((task_id, info))
+                elif info["next_due"] <= now:
+                    due.append(task_id)
+                    # 先按当前状态顺延，避免查询失败时下个周期立即重试
+                    info["next_due"] = now + self.interval_for(info)
+        if expired and self.store:
+            self.store.compact(self.expires_in_seconds)
+        if self.on_expire:
+            for task_id, info in expired:
+                self.on_expire(task_id, info)
+        return due
+
+    def wait_due(self, min_wait, max_wait):
+        """阻塞到最早的任务到期或有新任务加入，等待时间在 [min_wait, max_wait] 之间"""
+        self.changed.clear()
+        with self.lock:
+            next_due = min((info["next_due"] for info in self.tasks.values()), default=None)
+        delay = max_wait if next_due is None else min(max_wait, max(min_wait, next_due - time.time()))
+        self.changed.wait(delay)
+
+    def wakeup(self):
+        self.changed.set()
+
+    def update(self, task, now=None):
+        """根据代理返回的任务对象更新状态并计算下次查询时间"""
+        now = now or time.time()
+        with self.lock:
+            info = self.tasks.get(task["id"])
+            if info is None:
+                return
+            info["status"] = task.get("status") or info["status"]
+            info["action"] = task.get("action") or info["action"]
+            info["progress"] = parse_progress(task.get("progress"))
+            info["next_due"] = now + self.interval_for(info)
+
+    def interval_for(self, info):
+        if info["action"] in FAST_ACTIONS:
+            return self.intervals["fast_action"]
+        if info["status"] in QUEUED_STATUS:
+            return self.intervals["queued"]
+        if info["progress"] >= self.near_done_progress:
+            return self.intervals["near_done"]
+        return self.intervals["in_progress"]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
@@ -0,0 +1,59 @@
+# encoding:utf-8
+import sqlite3
+import threading
+import time
+
+from common.log import logger
+
+
+class TaskStore:
+    """基于 SQLite(WAL) 的进行中任务持久化，重启后可恢复轮询"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, state TEXT, user_id TEXT, action TEXT, "
+            "status TEXT, submit_time REAL, account TEXT)"
+        )
+        # 旧版数据库没有 account 列
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")]
+        if "account" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN account TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_submit_time ON tasks(submit_time)")
+
+    def add(self, task_id, state, user_id, action, status, submit_time, account=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, state, user_id, action, status, submit_time, account) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_id, state, user_id, action, status, submit_time, account),
+            )
+
+    def remove(self, task_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT task_id, state, user_id, action, status, submit_time, account FROM tasks"
+            ).fetchall()
+        keys = ("task_id", "state", "user_id", "action", "status", "submit_time", "account")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def compact(self, expires_in_seconds):
+        """删除已过期的任务，完成的任务在完成时已直接删除"""
+        with self.lock:
+            cur = self.conn.execute("DELETE FROM tasks WHERE submit_time < ?", (time.time() - expires_in_seconds,))
+            if cur.rowcount:
+                logger.info("[MJ] compacted %s expired tasks", cur.rowcount)
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,101 @@
+# encoding:utf-8
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+class _NullSpan:
+    """未开启追踪时使用的空 span，不做任何计时"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, stage, task_id, user_id):
+        self.tracer = tracer
+        self.stage = stage
+        self.task_id = task_id
+        self.user_id = user_id
+
+    def __enter__(self):
+        self.start = time.time()
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.write({
+            "stage": self.stage,
+            "task_id": self.task_id,
+            "user_id": self.user_id,
+            "start": round(self.start, 6),
+            "duration_ms": round((time.perf_counter() - self.begin) * 1000, 3),
+            "error": exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+
+class Tracer:
+    """按阶段记录耗时 span，以 JSON lines 格式追加写入文件"""
+
+    def __init__(self, path=None, enabled=False):
+        self.enabled = bool(enabled and path)
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8", buffering=1) if self.enabled else None
+
+    def span(self, stage, task_id=None, user_id=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, stage, task_id, user_id)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        if self.file:
+            with self.lock:
+                self.file.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[k]
+
+
+def summarize(path):
+    """统计每个阶段的 p50/p95/p99 耗时（毫秒）"""
+    durations = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            durations[record["stage"]].append(record["duration_ms"])
+    rows = []
+    for stage, values in sorted(durations.items()):
+        rows.append((stage, len(values), percentile(values, 50), percentile(values, 95), percentile(values, 99)))
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python tracing.py <trace.jsonl>")
+        sys.exit(1)
+    print("%-16s %8s %10s %10s %10s" % ("stage", "count", "p50(ms)", "p95(ms)", "p99(ms)"))
+    for stage, count, p50, p95, p99 in summarize(sys.argv[1]):
+        print("%-16s %8d %10.2f %10.2f %10.2f" % (stage, count, p50, p95, p99))
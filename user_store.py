@@ -0,0 +1,117 @@
+# encoding:utf-8
+import json
+import os
+import sqlite3
+import threading
+
+from common.log import logger
+from .ctext import read_pickle
+
+ROLL_NAMES = ("mj_admin_users", "mj_groups", "mj_users", "mj_bgroups", "mj_busers")
+
+
+def dump_item(item):
+    # 名单项可能是字符串或字典，统一序列化以便按值删除
+    return json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+
+class UserStore:
+    """基于 SQLite(WAL) 的用户次数和名单存储，每次修改只写入变更的记录"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS user_datas (user_id TEXT PRIMARY KEY, data TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS roll (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, item TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_roll_name ON roll(name)")
+        # 已完成的 pickle 导入，与导入的数据在同一事务中写入
+        self.conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+
+    def migrate_pickles(self, user_datas_path, roll_path):
+        """一次性导入旧版 pickle 文件，导入后重命名为 .migrated
+
+        导入记录和数据在同一事务中提交，重命名前崩溃时下次启动不会重复导入。
+        """
+        if os.path.exists(user_datas_path):
+            user_datas = read_pickle(user_datas_path)
+            if not isinstance(user_datas, dict):
+                logger.warning(f"[MJ] skip migrating {user_datas_path}: unexpected {type(user_datas).__name__}")
+                user_datas = {}
+            if self.migrate("user_datas", "INSERT OR REPLACE INTO user_datas (user_id, data) VALUES (?, ?)",
+                            [(user_id, json.dumps(data, ensure_ascii=False)) for user_id, data in user_datas.items()]):
+                logger.info(f"[MJ] migrated {len(user_datas)} users from {user_datas_path}")
+            os.replace(user_datas_path, user_datas_path + ".migrated")
+        if os.path.exists(roll_path):
+            roll = read_pickle(roll_path)
+            if not isinstance(roll, dict):
+                logger.warning(f"[MJ] skip migrating {roll_path}: unexpected {type(roll).__name__}")
+                roll = {}
+            if self.migrate("roll", "INSERT INTO roll (name, item) VALUES (?, ?)",
+                            [(name, dump_item(item)) for name in ROLL_NAMES for item in roll.get(name) or []]):
+                logger.info(f"[MJ] migrated roll from {roll_path}")
+            os.replace(roll_path, roll_path + ".migrated")
+
+    def migrate(self, name, sql, rows):
+        """在一个事务中写入数据并记录导入完成，已导入过时返回 False"""
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                if self.conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                    return False
+                self.conn.executemany(sql, rows)
+                self.conn.execute("INSERT INTO migrations (name) VALUES (?)", (name,))
+        return True
+
+    def load_users(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT user_id, data FROM user_datas").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_user(self, user_id, data):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO user_datas (user_id, data) VALUES (?, ?)",
+                (user_id, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def save_users(self, user_datas):
+        # 批量更新（如管理员重置次数）放在一个事务中
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO user_datas (user_id, data) VALUES (?, ?)",
+                    [(user_id, json.dumps(data, ensure_ascii=False)) for user_id, data in user_datas.items()],
+                )
+
+    def load_roll(self):
+        roll = {name: [] for name in ROLL_NAMES}
+        with self.lock:
+            rows = self.conn.execute("SELECT name, item FROM roll ORDER BY seq").fetchall()
+        for name, item in rows:
+            roll.setdefault(name, []).append(json.loads(item))
+        return roll
+
+    def roll_add(self, name, item):
+        with self.lock:
+            self.conn.execute("INSERT INTO roll (name, item) VALUES (?, ?)", (name, dump_item(item)))
+
+    def roll_remove(self, name, item):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM roll WHERE seq = (SELECT MIN(seq) FROM roll WHERE name = ? AND item = ?)",
+                (name, dump_item(item)),
+            )
+
+    def roll_clear(self, name):
+        with self.lock:
+            self.conn.execute("DELETE FROM roll WHERE name = ?", (name,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()